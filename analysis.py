@@ -180,9 +180,34 @@ def query_baseline_melanoma_tr1_samples(data_df):
 
     # analysis.py
 import pandas as pd
+import numpy as np
 from scipy import stats
 # Removed sqlite3 import as this file no longer directly queries the database.
 
+def _stack_ragged(arrays):
+    """Stacks 1-D arrays of different lengths into a 2-D float array, padding the tail of each row with NaN."""
+    matrix = np.full((len(arrays), max((len(a) for a in arrays), default=0)), np.nan)
+    for i, a in enumerate(arrays):
+        matrix[i, :len(a)] = a
+    return matrix
+
+def _isin_mask(series, values):
+    """
+    Returns a NumPy boolean array marking rows of `series` whose value is in `values`.
+    For categorical columns the comparison runs on the integer codes rather than the strings.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # The codes are the categorical's own contiguous int8 array (no copy); the handful of
+        # target values are looked up once and compared with plain == rather than np.isin,
+        # which sorts/hashes even for a single value
+        codes = series.cat.codes.to_numpy()
+        mask = np.zeros(len(codes), dtype=bool)
+        for code in series.cat.categories.get_indexer(values):
+            if code >= 0:
+                mask |= codes == codes.dtype.type(code)
+        return mask
+    return series.isin(values).to_numpy(copy=True)
+
 def get_relative_frequency(data_df_wide: pd.DataFrame):
     """
     Calculates the relative frequency of each cell type for each sample
@@ -247,6 +272,17 @@ def get_relative_frequency(data_df_wide: pd.DataFrame):
 
     return final_df
 
+def _melanoma_tr1_pbmc(data_df):
+    """
+    Returns the rows of data_df for melanoma PBMC samples treated with tr1.
+    Shared by the response analysis and the baseline queries.
+    """
+    # The predicates are fused into one boolean array, updated in place
+    mask = _isin_mask(data_df['condition'], ['melanoma'])
+    mask &= _isin_mask(data_df['treatment'], ['tr1'])
+    mask &= _isin_mask(data_df['sample_type'], ['PBMC'])
+    return data_df[mask]
+
 def analyze_melanoma_tr1_response(data_df):
     """
     Compares cell population relative frequencies between responders and non-responders
@@ -263,56 +299,66 @@ def analyze_melanoma_tr1_response(data_df):
             - dict: Dictionary of statistical test results.
     """
     
-    # Filter data for melanoma, tr1, PBMC samples with a response
-    filtered_df = data_df[
-        (data_df['condition'] == 'melanoma') &
-        (data_df['treatment'] == 'tr1') &
-        (data_df['sample_type'] == 'PBMC') &
-        (data_df['response'].isin(['y', 'n'])) # Ensure response is 'y' or 'n' 
-    ].copy()
+    # Filter data for melanoma, tr1, PBMC samples with a response ('y' or 'n')
+    melanoma_tr1_df = _melanoma_tr1_pbmc(data_df)
+    # Boolean indexing already returns a new frame; it is only read below, so no extra .copy()
+    filtered_df = melanoma_tr1_df[_isin_mask(melanoma_tr1_df['response'], ['y', 'n'])]
 
     if filtered_df.empty:
         print("No data found for melanoma patients receiving tr1 (PBMC samples) with defined response.")
         return pd.DataFrame(), {}
 
-    # Separate responders and non-responders
-    responders = filtered_df[filtered_df['response'] == 'y']
-    non_responders = filtered_df[filtered_df['response'] == 'n']
-
     cell_populations = ['b_cell', 'cd8_t_cell', 'cd4_t_cell', 'nk_cell', 'monocyte']
     statistical_results = {}
 
-    # print("\n--- Statistical Comparison (Responders vs. Non-Responders) ---") # Removed print for app context
-    for pop in cell_populations:
-        responder_values = responders[responders['population'] == pop]['percentage'].dropna()
-        non_responder_values = non_responders[non_responders['population'] == pop]['percentage'].dropna()
+    # Partition the filtered frame once by (population, response); categorical keys hit the factorized groupby path
+    group_keys = filtered_df[['population', 'response']].astype({
+        'population': pd.CategoricalDtype(cell_populations),
+        'response': pd.CategoricalDtype(['y', 'n'])
+    })
+    grouped = filtered_df['percentage'].groupby(
+        [group_keys['population'], group_keys['response']], observed=False, sort=True)
+
+    # Count first (non-null values per population x response, empty groups included);
+    # need at least 2 samples per group for statistics
+    sizes = grouped.count().unstack('response', fill_value=0).reindex(
+        index=cell_populations, columns=['y', 'n'], fill_value=0)
+    testable = ((sizes['y'] > 1) & (sizes['n'] > 1)).to_numpy()
+
+    # Only gather the float arrays for populations that will actually be tested
+    testable_pops = [pop for pop, is_testable in zip(cell_populations, testable) if is_testable]
+
+    statistics = np.full(len(cell_populations), np.nan)
+    p_values = np.full(len(cell_populations), np.nan)
+    if testable_pops:
+        # NaN-padded (population x sample) matrices so all populations are tested in one vectorized call
+        responder_values = _stack_ragged(
+            [grouped.get_group((pop, 'y')).dropna().to_numpy(dtype=float) for pop in testable_pops])
+        non_responder_values = _stack_ragged(
+            [grouped.get_group((pop, 'n')).dropna().to_numpy(dtype=float) for pop in testable_pops])
+        # nan_policy='omit' makes scipy fall back to a per-row Python loop, so only ask for it
+        # when the groups are actually ragged; equal-sized groups stay on the vectorized kernel
+        ragged = np.isnan(responder_values).any() or np.isnan(non_responder_values).any()
+        # Mann-Whitney U test (non-parametric), one call across all testable populations
+        statistics[testable], p_values[testable] = stats.mannwhitneyu(
+            responder_values, non_responder_values,
+            alternative='two-sided', axis=1, nan_policy='omit' if ragged else 'propagate'
+        )
 
-        if len(responder_values) > 1 and len(non_responder_values) > 1: # Need at least 2 samples for statistics
-            # Mann-Whitney U test (non-parametric)
-            statistic, p_value = stats.mannwhitneyu(responder_values, non_responder_values, alternative='two-sided')
-            
+    for pop, is_testable, statistic, p_value in zip(cell_populations, testable, statistics, p_values):
+        if is_testable:
             statistical_results[pop] = {
                 'statistic': statistic,
                 'p_value': p_value,
                 'significant': p_value < 0.05
             }
-            # Add back for local testing if needed, but suppressed for app console
-            # print(f"Population: {pop}")
-            # print(f"  Responder mean: {responder_values.mean():.2f}%")
-            # print(f"  Non-Responder mean: {non_responder_values.mean():.2f}%")
-            # print(f"  Mann-Whitney U statistic: {statistic:.2f}, P-value: {p_value:.4f}")
-            # if p_value < 0.05:
-            #     print(f"  -> Significant difference (p < 0.05) ")
-            # else:
-            #     print(f"  -> No significant difference (p >= 0.05) ")
         else:
             statistical_results[pop] = {
                 'statistic': None,
                 'p_value': None,
                 'significant': False
             }
-            # print(f"Population: {pop} - Not enough data for statistical test.")
-            
+
     return filtered_df, statistical_results
 
 def query_baseline_melanoma_tr1_samples(data_df):
@@ -382,21 +428,35 @@ def query_baseline_melanoma_tr1_samples(data_df):
 import pandas as pd
 import numpy as np
 from scipy import stats
-import matplotlib.pyplot as plt
-import seaborn as sns
+# matplotlib/seaborn are only needed by plot_response_comparison and take about a second to
+# import, so they are imported there rather than whenever this module is loaded
 from typing import Tuple, List
 
 class CytometryAnalysis:
     def __init__(self, data_loader):
         self.data_loader = data_loader
+        # Query results cached on first use, so the report and plot reuse them
+        self._freq_df = None
+        self._resp_df = None
+        self._baseline_df = None
+    
+    def clear_cache(self):
+        """Drop cached query results, e.g. after loading new data."""
+        self._freq_df = None
+        self._resp_df = None
+        self._baseline_df = None
     
     def analyze_cell_frequencies(self) -> pd.DataFrame:
         """Get cell frequency analysis for all samples."""
-        return self.data_loader.get_cell_frequencies()
+        if self._freq_df is None:
+            self._freq_df = self.data_loader.get_cell_frequencies()
+        return self._freq_df
     
     def analyze_response_comparison(self) -> Tuple[pd.DataFrame, List[str]]:
         """Analyze differences between responders and non-responders."""
-        df = self.data_loader.get_response_comparison()
+        if self._resp_df is None:
+            self._resp_df = self.data_loader.get_response_comparison()
+        df = self._resp_df
         
         # Perform statistical analysis for each population
         significant_populations = []
@@ -424,6 +484,9 @@ class CytometryAnalysis:
     
     def plot_response_comparison(self, save_path: str = None):
         """Create boxplots comparing responders vs non-responders."""
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+
         df, significant_populations = self.analyze_response_comparison()
         
         # Set up the plot
@@ -463,7 +526,9 @@ class CytometryAnalysis:
     
     def analyze_baseline_melanoma_tr1(self) -> pd.DataFrame:
         """Analyze baseline melanoma tr1 samples."""
-        return self.data_loader.get_baseline_melanoma_tr1()
+        if self._baseline_df is None:
+            self._baseline_df = self.data_loader.get_baseline_melanoma_tr1()
+        return self._baseline_df
     
     def generate_summary_report(self, output_path: str = None):
         """Generate a comprehensive summary report."""
@@ -493,11 +558,12 @@ class CytometryAnalysis:
         # Baseline analysis summary
         summary.append("\nBaseline Melanoma TR1 Analysis:")
         summary.append("-" * 30)
-        for _, row in baseline.iterrows():
+        # itertuples yields plain namedtuples instead of building a Series per row
+        for row in baseline.itertuples(index=False):
             summary.append(
-                f"Project {row['project_id']}: "
-                f"{row['sample_count']} samples from {row['subject_count']} subjects "
-                f"({row['sex']}, {row['response']})"
+                f"Project {row.project_id}: "
+                f"{row.sample_count} samples from {row.subject_count} subjects "
+                f"({row.sex}, {row.response})"
             )
         
         # Write to file if path provided
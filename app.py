@@ -1,14 +1,21 @@
 # app.py
 import dash
-from dash import dcc, html, Input, Output, State, dash_table
+from dash import dcc, html, Input, Output, State, dash_table, Patch
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
+import numpy as np
+# plotly.graph_objects / plotly.subplots are imported inside the plotting callback, so worker
+# start-up doesn't pay for them until a user first runs the response comparison
 import sqlite3
 import os
 import io
+import json
 import base64
 import math # Import math for ceil function
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import fcntl # POSIX only; used to serialize the startup DB rebuild across workers
+except ImportError:
+    fcntl = None
 
 
 # Import your custom modules (ensure these files are in the same directory)
@@ -19,102 +26,335 @@ import analysis
 
 # --- Database Initialization and Data Loading ---
 # This part ensures the database is ready when the app starts.
-# It will remove any existing DB file for a clean start on each app launch (useful for development).
+# An existing database is reused as is: the CSV is only loaded into a missing or empty database,
+# or one written by an older schema/load version (database.SCHEMA_VERSION).
+# Wiping and reloading it is opt-in, with CYTO_RESET_DB=1 or by running this file directly (the
+# dev entrypoint), so production workers never throw away data added through the app. The debug
+# reloader re-runs this file as __main__ in a child process (with WERKZEUG_RUN_MAIN set) after
+# every code change; only the outer process resets, so dev data survives a save.
+# Every worker process imports this module, so the check + load runs under an exclusive file
+# lock: the first worker loads, the others wait and then find the samples already there.
 # For production, you might want a more sophisticated DB management strategy (e.g., migrations).
-if os.path.exists(database.db_name):
-    os.remove(database.db_name)
-    print(f"Existing database '{database.db_name}' removed for a clean start.")
-database.init_database()
-database.load_data_from_csv('cell-count.csv')
-print("Database initialized and data loaded successfully for Dash app.")
+CSV_PATH = 'cell-count.csv'
+DB_LOCK_PATH = database.db_name + '.lock'
+RESET_DB_ENV_VAR = 'CYTO_RESET_DB'
+
+def _database_needs_load():
+    """True if the DB file is missing, was written by another schema version, or has no samples."""
+    if not os.path.exists(database.db_name):
+        return True
+    conn = sqlite3.connect(database.db_name)
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version != database.SCHEMA_VERSION:
+            print(f"Database '{database.db_name}' has schema version {version}, "
+                  f"expected {database.SCHEMA_VERSION}; rebuilding it from '{CSV_PATH}'.")
+            return True
+        return conn.execute("SELECT 1 FROM samples LIMIT 1").fetchone() is None
+    except sqlite3.OperationalError: # No samples table
+        return True
+    finally:
+        conn.close()
+
+def _reset_and_load_database():
+    """Recreates the DB from the CSV."""
+    if os.path.exists(database.db_name):
+        os.remove(database.db_name)
+        print(f"Existing database '{database.db_name}' removed for a clean start.")
+    database.init_database()
+    database.load_data_from_csv(CSV_PATH)
+    print("Database initialized and data loaded successfully for Dash app.")
+
+def prepare_database(reset=False):
+    """
+    Loads the CSV into the DB if the DB is missing, empty or outdated (or always, if reset is True),
+    serialized across processes.
+    """
+    with open(DB_LOCK_PATH, 'w') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX) # Released when the file is closed
+        if reset or _database_needs_load():
+            try:
+                _reset_and_load_database()
+            except Exception:
+                # Stop here rather than serve an empty database
+                print(f"Could not load '{CSV_PATH}' into '{database.db_name}'; the app was not started.")
+                raise
+        else:
+            print(f"Using existing database '{database.db_name}'; skipping reload from '{CSV_PATH}'.")
+
+_is_reloader_child = os.environ.get('WERKZEUG_RUN_MAIN') == 'true'
+prepare_database(reset=os.environ.get(RESET_DB_ENV_VAR) == '1'
+                 or (__name__ == '__main__' and not _is_reloader_child))
 
 
 # --- Helper Function to Fetch All Data in Wide Format for DataTable ---
 # This function is crucial as it provides the raw data in a wide format
 # for the 'full-dataset-table' and as input for analysis functions.
+# The result is memoized per database.data_version (bumped on every committed write in this
+# process) plus the DB file stats (which also change when another worker process commits), so
+# callbacks that run between writes reuse one DataFrame instead of re-running the query.
+# The table records built from it are memoized alongside (see get_all_data_records).
+_display_data_cache = {'key': None, 'df': None, 'records': None}
+
+def _database_file_token():
+    """(mtime, size) of the DB file and of its non-empty WAL, identifying the stored data."""
+    db_stat = os.stat(database.db_name)
+    token = [db_stat.st_mtime_ns, db_stat.st_size]
+    wal_path = database.db_name + '-wal'
+    if os.path.exists(wal_path) and os.path.getsize(wal_path) > 0:
+        wal_stat = os.stat(wal_path)
+        token += [wal_stat.st_mtime_ns, wal_stat.st_size]
+    return token
+
+def _data_cache_key():
+    """Identifies the current DB contents for the in-process caches, or None if there is no DB file."""
+    try:
+        return (database.data_version, tuple(_database_file_token()))
+    except OSError: # No DB file yet; callers query uncached and report the error
+        return None
+
 def get_all_data_for_display():
     """
     Fetches all data from DB, pivots cell counts to columns, and returns a wide-format DataFrame.
     This structure is suitable for `dash_table.DataTable` and as input for analysis functions.
     Columns are renamed to match the original CSV headers for display consistency.
     The data is ordered by sample_id in a natural (alphanumeric then numeric) ascending order.
+    The returned DataFrame is shared between callers, so treat it as read-only.
     """
-    conn = database.get_db_connection()
+    key = _data_cache_key()
+    if key is None or _display_data_cache['key'] != key:
+        df = _query_all_data_for_display()
+        if df is None: # Query failed; don't cache the error result
+            return pd.DataFrame()
+        _display_data_cache['key'] = key
+        _display_data_cache['df'] = df
+        _display_data_cache['records'] = None
+    return _display_data_cache['df']
+
+# The long-format relative frequency frame (database.fetch_relative_frequency), memoized the same way.
+# A refresh click re-runs the response analysis even when nothing changed; with the cache it reuses
+# this frame instead of re-reading the whole view.
+_relative_frequency_cache = {'key': None, 'df': None}
+
+def get_relative_frequency_long():
+    """
+    database.fetch_relative_frequency(), cached until the data changes.
+    The returned DataFrame is shared between callers, so treat it as read-only.
+    """
+    key = _data_cache_key()
+    if key is None or _relative_frequency_cache['key'] != key:
+        df = database.fetch_relative_frequency()
+        if key is None:
+            return df
+        _relative_frequency_cache['key'] = key
+        _relative_frequency_cache['df'] = df
+    return _relative_frequency_cache['df']
+
+def get_all_data_records():
+    """
+    df_to_records(get_all_data_for_display()), converted once per cached frame: a refresh
+    click and the post-save reload reuse the list while the data is unchanged.
+    The returned list is shared between callers, so treat it as read-only.
+    """
+    df = get_all_data_for_display()
+    if _display_data_cache['df'] is not df: # Query failed; nothing cached to attach records to
+        return df_to_records(df)
+    if _display_data_cache['records'] is None:
+        _display_data_cache['records'] = df_to_records(df)
+    return _display_data_cache['records']
+
+# Sample-level columns of the wide display frame, in display order (the cell count
+# columns follow them, one per population)
+DISPLAY_ID_COLUMNS = [
+    'project', 'subject', 'age', 'sex', 'sample', 'condition',
+    'treatment', 'response', 'sample_type', 'time_from_treatment_start'
+]
+# Populations that always get a column (in this order), even if no sample has counts for them;
+# any other population found in cell_counts is appended after these
+DISPLAY_POPULATIONS = ['b_cell', 'cd8_t_cell', 'cd4_t_cell', 'nk_cell', 'monocyte']
+# Sample columns with only a handful of distinct values, stored as categoricals
+DISPLAY_CATEGORY_COLUMNS = ['project', 'sex', 'condition', 'treatment', 'response', 'sample_type']
+
+# Query to get all sample details with one summed count per (sample, population).
+# The pivot of populations into columns happens in NumPy afterwards: a plain GROUP BY is a
+# single pass over cell_counts, where five SUM(CASE ...) aggregates evaluate every
+# branch for every row, and the population list no longer has to be spelled out here.
+# No ORDER BY: the natural sample order is applied to the pivoted frame in pandas.
+# The unfiltered text is a module constant, so every call passes SQLite the identical string
+# and the connection's statement cache reuses the compiled statement instead of re-preparing it.
+_DISPLAY_QUERY_TEMPLATE = """
+    SELECT
+        p.project_id AS project,
+        s.subject_id AS subject,
+        s.age,
+        s.sex,
+        samp.sample_id AS sample,
+        samp.condition,
+        samp.treatment,
+        samp.response,
+        samp.sample_type,
+        samp.time_from_treatment_start,
+        cc.population,
+        SUM(cc.count) AS count
+    FROM projects p
+    JOIN subjects s ON p.project_id = s.project_id
+    JOIN samples samp ON s.subject_id = samp.subject_id
+    LEFT JOIN cell_counts cc ON samp.sample_id = cc.sample_id
+    {where_sql}
+    GROUP BY samp.sample_id, cc.population
+"""
+_DISPLAY_QUERY = _DISPLAY_QUERY_TEMPLATE.format(where_sql="")
+_DISPLAY_QUERY_COLUMNS = DISPLAY_ID_COLUMNS + ['population', 'count']
+
+def _query_all_data_for_display(sample_ids=None):
+    """
+    Uncached query behind get_all_data_for_display; returns None on error.
+    If sample_ids is given, only those samples' rows are fetched.
+    """
+    params = []
+    query = _DISPLAY_QUERY
+    if sample_ids is not None:
+        params = [str(sample_id) for sample_id in sample_ids]
+        query = _DISPLAY_QUERY_TEMPLATE.format(
+            where_sql=f"WHERE samp.sample_id IN ({', '.join('?' * len(params))})")
     try:
-        # Query to get all sample details and pivot cell counts into columns
-        # ORDER BY is now using a natural sort for alphanumeric sample_ids
-        query = """
-        SELECT
-            p.project_id AS project,
-            s.subject_id AS subject,
-            s.age,
-            s.sex,
-            samp.sample_id AS sample,
-            samp.condition,
-            samp.treatment,
-            samp.response,
-            samp.sample_type,
-            samp.time_from_treatment_start,
-            SUM(CASE WHEN cc.population = 'b_cell' THEN cc.count ELSE 0 END) AS b_cell,
-            SUM(CASE WHEN cc.population = 'cd8_t_cell' THEN cc.count ELSE 0 END) AS cd8_t_cell,
-            SUM(CASE WHEN cc.population = 'cd4_t_cell' THEN cc.count ELSE 0 END) AS cd4_t_cell,
-            SUM(CASE WHEN cc.population = 'nk_cell' THEN cc.count ELSE 0 END) AS nk_cell,
-            SUM(CASE WHEN cc.population = 'monocyte' THEN cc.count ELSE 0 END) AS monocyte
-        FROM projects p
-        JOIN subjects s ON p.project_id = s.project_id
-        JOIN samples samp ON s.subject_id = samp.subject_id
-        LEFT JOIN cell_counts cc ON samp.sample_id = cc.sample_id
-        GROUP BY p.project_id, s.subject_id, s.age, s.sex, samp.sample_id, samp.condition,
-                 samp.treatment, samp.response, samp.sample_type, samp.time_from_treatment_start
-        ORDER BY
-            SUBSTR(samp.sample_id, 1, 1) ASC,          -- Sorts by the prefix character (e.g., 's')
-            CAST(SUBSTR(samp.sample_id, 2) AS INTEGER) ASC; -- Then by the numeric part as an integer
-        """
-        df = pd.read_sql_query(query, conn)
+        # Reuses the shared read connection instead of opening the database per call.
+        # The rows go straight into from_records with the known column names, skipping
+        # read_sql_query's cursor.description handling and per-column conversion pass.
+        with database.read_lock():
+            rows = database.get_read_connection().execute(query, params).fetchall()
     except Exception as e:
         print(f"Error fetching data for display: {e}")
-        return pd.DataFrame()
-    finally:
-        conn.close()
+        return None
+    long_df = pd.DataFrame.from_records(rows, columns=_DISPLAY_QUERY_COLUMNS)
+    return _natural_sort_samples(_pivot_display_counts(long_df))
+
+def _pivot_display_counts(long_df):
+    """
+    Pivots the (sample, population, count) rows of the display query into one count column
+    per population, keeping the samples in query order. Missing counts are 0.
+    Equivalent to pivot_table(..., aggfunc='sum', fill_value=0) on the sample columns, but the
+    counts are scattered into a preallocated NumPy matrix by integer codes, without the
+    groupby/reshape machinery (SQLite has already summed duplicates).
+    """
+    # Samples keep the order in which they first appear in the query result
+    sample_codes, samples = pd.factorize(long_df['sample'], sort=False)
+    populations = long_df['population'].dropna().unique().tolist()
+    populations = DISPLAY_POPULATIONS + sorted(set(populations) - set(DISPLAY_POPULATIONS))
+    # Samples without any cell counts come back as one row with a NULL population (code -1)
+    population_codes = pd.Index(populations).get_indexer(long_df['population'])
+    has_count = population_codes >= 0
+
+    counts = np.zeros((len(samples), len(populations)), dtype=np.int64)
+    counts[sample_codes[has_count], population_codes[has_count]] = (
+        long_df['count'].to_numpy()[has_count].astype(np.int64))
+
+    # The sample-level columns repeat on each of a sample's rows; keep the first row per sample
+    # (codes are numbered by first appearance, so these come out in code order)
+    first_rows = np.unique(sample_codes, return_index=True)[1]
+    df = long_df[DISPLAY_ID_COLUMNS].take(first_rows)
+    df.index = pd.RangeIndex(len(df))
+    # Narrow the integer columns: the pivoted counts are never NULL, so they fit int32 directly;
+    # age/time can be NULL (float), so they are only downcast when they are whole numbers
+    for col_index, population in enumerate(populations):
+        df[population] = counts[:, col_index].astype(np.int32)
+    for col in ['age', 'time_from_treatment_start']:
+        df[col] = pd.to_numeric(df[col], downcast='integer')
+    # The repeated low-cardinality labels as categoricals (1-byte codes instead of one string
+    # per row); tolist() still yields the plain strings, so the table records are unchanged
+    for col in DISPLAY_CATEGORY_COLUMNS:
+        df[col] = df[col].astype('category')
     return df
 
+def _natural_sort_samples(df):
+    """
+    Orders the wide frame by sample_id in natural order (database.SAMPLE_ID_PATTERN): the
+    non-digit prefix first, then the trailing number as an integer (s1, s2, ..., s10). Done once
+    per sample in pandas on the pivoted frame rather than per joined row inside SQLite, and
+    multi-character or missing prefixes sort correctly. Ties keep the plain string order.
+    """
+    sample_ids = df['sample'].astype(str)
+    parts = sample_ids.str.extract(database.SAMPLE_ID_PATTERN.pattern)
+    prefix = parts[0].fillna(sample_ids)
+    number = pd.to_numeric(parts[1], errors='coerce').fillna(-1)
+    # np.lexsort uses the last key as the primary one: prefix, then number, then the full string
+    order = np.lexsort((sample_ids.to_numpy(), number.to_numpy(), prefix.to_numpy()))
+    sorted_df = df.take(order)
+    sorted_df.index = pd.RangeIndex(len(sorted_df))
+    return sorted_df
+
+# --- Helper Function to Convert DataFrames to DataTable Records ---
+def df_to_records(df):
+    """
+    Same list of row dicts as df.to_dict('records'), built from one tolist() per column
+    and zip: the values are converted column-wise to Python objects in C, instead of
+    pandas boxing each cell while it builds the dicts (~3x faster on large tables).
+    """
+    columns = list(df.columns)
+    return [dict(zip(columns, row)) for row in zip(*(df[col].tolist() for col in columns))]
+
+
 # --- Helper Function for Initial DataTable Columns ---
 # This helper now ensures the 'sample' column is editable for user input.
+# Columns of the full dataset table, in display order (the display query's columns), and
+# the ones holding numbers; every other column is text
+FULL_TABLE_COLUMNS = tuple(DISPLAY_ID_COLUMNS + DISPLAY_POPULATIONS)
+NUMERIC_COLS = frozenset({'age', 'time_from_treatment_start', *DISPLAY_POPULATIONS})
+
+# The column spec is static, so it is built once here instead of querying the DB to probe dtypes
+_COLUMN_SPEC = [
+    {"name": col, "id": col, "editable": True, "type": "numeric" if col in NUMERIC_COLS else "text"}
+    for col in FULL_TABLE_COLUMNS
+]
+
 def get_initial_table_columns():
     """
     Generates the initial column structure for the full-dataset-table,
     including editable properties and data types. 'sample' is now editable.
+    Returns a fresh copy of the static spec, so callers may modify it.
     """
-    df = get_all_data_for_display() # Get current data to infer columns
-    columns = []
-    if not df.empty:
-        for col in df.columns:
-            col_type = 'text'
-            if pd.api.types.is_numeric_dtype(df[col]):
-                col_type = 'numeric'
-            
-            col_dict = {"name": col, "id": col, "editable": True, "type": col_type}
-            # The 'sample' column is intentionally left as editable: True here
-            columns.append(col_dict)
-    else: # Fallback if DB is completely empty (e.g., first run before any data is loaded)
-        columns = [
-            {"name": "project", "id": "project", "editable": True},
-            {"name": "subject", "id": "subject", "editable": True},
-            {"name": "age", "id": "age", "editable": True, "type": "numeric"},
-            {"name": "sex", "id": "sex", "editable": True},
-            {"name": "sample", "id": "sample", "editable": True}, # NOW EDITABLE for new rows
-            {"name": "condition", "id": "condition", "editable": True},
-            {"name": "treatment", "id": "treatment", "editable": True},
-            {"name": "response", "id": "response", "editable": True},
-            {"name": "sample_type", "id": "sample_type", "editable": True},
-            {"name": "time_from_treatment_start", "id": "time_from_treatment_start", "editable": True, "type": "numeric"},
-            {"name": "b_cell", "id": "b_cell", "editable": True, "type": "numeric"},
-            {"name": "cd8_t_cell", "id": "cd8_t_cell", "editable": True, "type": "numeric"},
-            {"name": "cd4_t_cell", "id": "cd4_t_cell", "editable": True, "type": "numeric"},
-            {"name": "nk_cell", "id": "nk_cell", "editable": True, "type": "numeric"},
-            {"name": "monocyte", "id": "monocyte", "editable": True, "type": "numeric"},
-        ]
-    return columns
+    return [dict(col_dict) for col_dict in _COLUMN_SPEC]
+
+
+# --- Initial table payload, cached on disk ---
+# Building the first page of the full dataset table means running the pivot query and converting
+# it to records in every worker process at import. The records are written to a JSON
+# file next to the DB, tagged with the DB/WAL file stats; a worker that finds a matching tag just
+# loads the JSON. Any committed write changes those stats, so the cache can never be stale.
+INITIAL_PAYLOAD_CACHE_PATH = database.db_name + '.initial.json'
+
+def load_initial_table_payload():
+    """
+    Returns the initial full-dataset-table records, from the on-disk cache
+    if it matches the current DB files, otherwise from the DB (refreshing the cache).
+    """
+    try:
+        with open(INITIAL_PAYLOAD_CACHE_PATH) as cache_file:
+            cached = json.load(cache_file)
+        if cached['token'] == _database_file_token():
+            return cached['records']
+    except (OSError, ValueError, KeyError):
+        pass # Missing or unreadable cache: rebuild it below
+
+    records = get_all_data_records()
+    try:
+        # Write to a temp file and rename, so concurrent workers never read a partial file
+        tmp_path = f"{INITIAL_PAYLOAD_CACHE_PATH}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as cache_file:
+            # Compact separators: the key names repeat in every record, so the default ', ' / ': '
+            # padding alone adds two bytes per field to the file every worker parses at start-up
+            json.dump({'token': _database_file_token(), 'records': records},
+                      cache_file, separators=(',', ':'),
+                      default=lambda value: value.item() if hasattr(value, 'item') else str(value))
+        os.replace(tmp_path, INITIAL_PAYLOAD_CACHE_PATH)
+    except OSError as e:
+        print(f"Could not write initial table cache: {e}")
+    return records
+
+# Computed once at import and reused by the layout; the columns are the static spec
+initial_table_records = load_initial_table_payload()
+initial_table_columns = get_initial_table_columns()
 
 
 # --- Initialize the Dash app ---
@@ -184,8 +424,8 @@ app.layout = html.Div(className='container mx-auto p-6 bg-gray-50 min-h-screen f
             dash_table.DataTable(
                 id='full-dataset-table',
                 # SET INITIAL DATA AND COLUMNS HERE for automatic display on load:
-                data=get_all_data_for_display().to_dict('records'), # Initial data from DB
-                columns=get_initial_table_columns(), # Initial columns setup (now sample is editable)
+                data=initial_table_records, # Initial data from DB (via the on-disk payload cache)
+                columns=initial_table_columns, # Initial columns setup (now sample is editable)
                 page_size=10, # Display 10 rows per page
                 style_table={'overflowX': 'auto'}, # Allow horizontal scrolling
                 style_cell={'textAlign': 'left', 'padding': '5px'},
@@ -209,12 +449,17 @@ app.layout = html.Div(className='container mx-auto p-6 bg-gray-50 min-h-screen f
         html.Button('Refresh Relative Frequencies', id='refresh-data-button', n_clicks=0, className='bg-green-500 hover:bg-green-700 text-white font-bold py-2 px-4 rounded-md shadow-md transition duration-300 ease-in-out mb-4'),
         dash_table.DataTable(
             id='relative-frequencies-table',
-            columns=[{"name": i, "id": i} for i in ['sample', 'total_count', 'population', 'count', 'percentage']], # Columns for long format
-            # Initial data load: Get wide data, then pass to analysis.get_relative_frequency
-            data=analysis.get_relative_frequency(get_all_data_for_display()).to_dict('records'),
-            filter_action="native",
-            sort_action="native",
-            page_action="native",
+            columns=[{"name": i, "id": i} for i in database.rel_freq_page_columns], # Columns for long format
+            # Paged server-side: only the visible page is queried (LIMIT/OFFSET in SQLite) and sent to
+            # the browser. The first page is filled by update_relative_frequencies_page on load.
+            data=[],
+            filter_action="custom",
+            filter_query='',
+            sort_action="custom",
+            sort_mode="multi",
+            sort_by=[],
+            page_action="custom",
+            page_current=0,
             page_size=10,
             style_table={'overflowX': 'auto'},
             style_header={
@@ -262,104 +507,210 @@ app.layout = html.Div(className='container mx-auto p-6 bg-gray-50 min-h-screen f
 ])
 
 
+# --- Helpers for partial (Patch) updates of the full dataset table ---
+# Upload/delete only touch a few samples, so instead of re-sending the whole table the callbacks
+# send a Patch with just the changed rows. Above this many samples a full reload is cheaper.
+MAX_PATCHED_SAMPLES = 500
+
+def _patch_upserted_samples(current_table_data, sample_ids):
+    """
+    Returns the new full-dataset-table data after `sample_ids` were added/replaced in the DB:
+    a Patch that overwrites rows already shown and appends the others, or the full
+    refreshed table if many samples changed.
+    """
+    if len(sample_ids) > MAX_PATCHED_SAMPLES:
+        return get_all_data_records()
+    rows_df = _query_all_data_for_display(sample_ids)
+    if rows_df is None:
+        return dash.no_update
+    index_by_sample = {str(row.get('sample')): i for i, row in enumerate(current_table_data or [])}
+    patch = Patch()
+    for row in df_to_records(rows_df):
+        row_index = index_by_sample.get(str(row['sample']))
+        if row_index is None:
+            patch.append(row)
+        else:
+            patch[row_index] = row
+    return patch
+
+def _patch_removed_samples(current_table_data, sample_ids):
+    """Returns a Patch deleting the full-dataset-table rows of the given sample IDs."""
+    removed = {str(sample_id) for sample_id in sample_ids}
+    patch = Patch()
+    # Delete from the end so the earlier row indices stay valid
+    for row_index in reversed(range(len(current_table_data or []))):
+        if str(current_table_data[row_index].get('sample')) in removed:
+            del patch[row_index]
+    return patch
+
+
 # --- Callbacks ---
 
 # Callback for Adding Multiple Samples via CSV Upload
+# Text columns of an uploaded CSV, read as strings rather than inferred
+UPLOAD_TEXT_DTYPES = {col: str for col in FULL_TABLE_COLUMNS if col not in NUMERIC_COLS}
+# Rows per chunk when reading an uploaded CSV; each chunk is validated while the previous one is inserted
+UPLOAD_CHUNK_ROWS = 10_000
+
+def _validate_upload_chunk(df):
+    """
+    Checks and coerces (in place) one chunk of an uploaded file.
+    Returns an error message for the user, or None if the chunk is valid.
+    """
+    # --- Data Validation (IMPORTANT!) ---
+    required_cols = ['project', 'subject', 'condition', 'age', 'sex', 'treatment',
+                     'response', 'sample', 'sample_type', 'time_from_treatment_start',
+                     'b_cell', 'cd8_t_cell', 'cd4_t_cell', 'nk_cell', 'monocyte']
+    if not all(col in df.columns for col in required_cols):
+        missing = [col for col in required_cols if col not in df.columns]
+        return f'Error: Missing required columns in uploaded file: {", ".join(missing)}'
+
+    # Basic type conversion and validation for critical columns
+    for col in ['age', 'time_from_treatment_start'] + [c for c in required_cols if c in ['b_cell', 'cd8_t_cell', 'cd4_t_cell', 'nk_cell', 'monocyte']]:
+        if col in df.columns:
+            # Columns the parser already typed as numbers need no per-value coercion
+            if not pd.api.types.is_numeric_dtype(df[col]):
+                df[col] = pd.to_numeric(df[col], errors='coerce')
+            # Allow NaNs for age/time_from_treatment_start/response, but not for cell counts
+            if df[col].isnull().any() and col not in ['age', 'time_from_treatment_start', 'response']:
+                return f'Error: Numeric values required in column "{col}".'
+            # Fill NaN with 0 for counts/time/age and convert to int
+            df[col] = df[col].fillna(0).astype(int)
+
+    if 'response' in df.columns:
+        df['response'] = df['response'].astype(str).str.lower().str.strip()
+        df['response'] = df['response'].replace({'none': None, 'nan': None, '': None}) # Treat 'none' or 'nan' string as actual None
+        if not df['response'].fillna('valid').isin(['y', 'n', 'valid']).all():
+            return 'Error: "response" column contains invalid values. Must be "y", "n", or empty/blank.'
+    return None
+
 @app.callback(
     Output('output-upload-status', 'children'), # Output to dedicated Div
+    Output('full-dataset-table', 'data', allow_duplicate=True), # Patch in just the uploaded rows
     Input('upload-data', 'contents'),
     State('upload-data', 'filename'),
     State('upload-data', 'last_modified'),
+    State('full-dataset-table', 'data'),
     prevent_initial_call=True # Prevents callback from firing on app load
 )
-def upload_data(contents, filename, last_modified):
+def upload_data(contents, filename, last_modified, current_table_data):
     if contents is None:
-        return ""
+        return "", dash.no_update
 
     try:
         content_type, content_string = contents.split(',')
         decoded = base64.b64decode(content_string)
 
         if 'csv' in filename:
-            df = pd.read_csv(io.StringIO(decoded.decode('utf-8')))
+            # Text columns are declared up front, so the C parser skips type inference for them
+            # (and numeric-looking IDs are not turned into floats); counts/age/time are inferred
+            # The parser reads and UTF-8 decodes the bytes itself, so no decoded str copy of the file is made
+            chunks = pd.read_csv(io.BytesIO(decoded), encoding='utf-8', dtype=UPLOAD_TEXT_DTYPES,
+                                 chunksize=UPLOAD_CHUNK_ROWS)
         elif 'xls' in filename or 'xlsx' in filename: # Added Excel support
-            df = pd.read_excel(io.BytesIO(decoded))
+            chunks = [pd.read_excel(io.BytesIO(decoded))]
         else:
-            return html.Div('Please upload a .csv or .xlsx file.', className='text-red-600')
-
-        # --- Data Validation (IMPORTANT!) ---
-        required_cols = ['project', 'subject', 'condition', 'age', 'sex', 'treatment',
-                         'response', 'sample', 'sample_type', 'time_from_treatment_start',
-                         'b_cell', 'cd8_t_cell', 'cd4_t_cell', 'nk_cell', 'monocyte']
-        if not all(col in df.columns for col in required_cols):
-            missing = [col for col in required_cols if col not in df.columns]
-            return html.Div(f'Error: Missing required columns in uploaded file: {", ".join(missing)}', className='text-red-600')
-
-        # Basic type conversion and validation for critical columns
-        for col in ['age', 'time_from_treatment_start'] + [c for c in required_cols if c in ['b_cell', 'cd8_t_cell', 'cd4_t_cell', 'nk_cell', 'monocyte']]:
-            if col in df.columns:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-                # Allow NaNs for age/time_from_treatment_start/response, but not for cell counts
-                if df[col].isnull().any() and col not in ['age', 'time_from_treatment_start', 'response']:
-                    return html.Div(f'Error: Numeric values required in column "{col}".', className='text-red-600')
-                # Fill NaN with 0 for counts/time/age and convert to int
-                df[col] = df[col].fillna(0).astype(int) 
-
-        if 'response' in df.columns:
-            df['response'] = df['response'].astype(str).str.lower().str.strip()
-            df['response'] = df['response'].replace({'none': None, 'nan': None, '': None}) # Treat 'none' or 'nan' string as actual None
-            if not df['response'].fillna('valid').isin(['y', 'n', 'valid']).all():
-                return html.Div('Error: "response" column contains invalid values. Must be "y", "n", or empty/blank.', className='text-red-600')
-
+            return html.Div('Please upload a .csv or .xlsx file.', className='text-red-600'), dash.no_update
+
+        # Parsing/validating is CPU work and inserting is I/O-bound, so they are pipelined: chunk i
+        # is inserted on a worker thread while chunk i+1 is parsed and validated here. The worker
+        # borrows this thread's connection (opened with check_same_thread=False, see
+        # database.get_db_connection), and only one thread uses it at a time: while an insert is
+        # pending this thread doesn't touch the connection, and it waits for the insert (and any
+        # still-running one when leaving the executor) before the next insert, commit or rollback.
+        # All the chunks go into one transaction that is committed after the last one, so the
+        # upload is all-or-nothing, as when the whole file was validated before any insert.
         conn = database.get_db_connection()
+        added_sample_ids = [] # Samples of the chunks inserted so far (uncommitted)
+
+        def upload_failed(message):
+            # Nothing from the file is kept: roll back the chunks inserted so far
+            if conn.in_transaction:
+                conn.rollback()
+            return html.Div(f'{message} No rows from the file were added.', className='text-red-600'), dash.no_update
+
+        def finish_insert(insert, sample_ids):
+            # Waits for an insert; returns the failure response if it raised, else None
+            try:
+                insert.result()
+            except sqlite3.IntegrityError as e:
+                return upload_failed(f'Database Error: {e}. Check for duplicate sample IDs or other integrity constraints (e.g., existing sample ID, subject ID).')
+            except Exception as e:
+                print(f"Error in upload_data callback: {e}") # Log the error to console
+                return upload_failed(f'Error adding data to database: {e}')
+            added_sample_ids.extend(sample_ids)
+            return None
+
+        conn.execute("BEGIN IMMEDIATE") # Take the write lock once, for the whole file
         try:
-            database.bulk_add_data(conn, df)
-            return html.Div(f'{len(df)} samples from "{filename}" successfully added to the database.', className='text-green-600')
-        except sqlite3.IntegrityError as e:
-            return html.Div(f'Database Error: {e}. Check for duplicate sample IDs or other integrity constraints (e.g., existing sample ID, subject ID).', className='text-red-600')
-        except Exception as e:
-            print(f"Error in upload_data callback: {e}") # Log the error to console
-            return html.Div(f'Error adding data to database: {e}', className='text-red-600')
-        finally:
-            conn.close()
+            # Leaving the with block waits for a still-running insert, even if parsing raised
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                pending = None # (future, sample IDs) of the chunk being inserted
+                for chunk in chunks:
+                    error = _validate_upload_chunk(chunk)
+                    if pending is not None:
+                        failure = finish_insert(*pending)
+                        pending = None
+                        if failure:
+                            return failure
+                    if error:
+                        return upload_failed(error)
+                    pending = (executor.submit(database.bulk_add_data, conn, chunk, commit=False),
+                               chunk['sample'].tolist())
+                if pending is not None:
+                    failure = finish_insert(*pending)
+                    if failure:
+                        return failure
+            conn.commit()
+        except Exception:
+            # e.g. a parse error in a later chunk: roll back the earlier chunks before reporting it
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        database.bump_data_version() # The rows are visible to other connections only from here
+
+        return (html.Div(f'{len(added_sample_ids)} samples from "{filename}" successfully added to the database.', className='text-green-600'),
+                _patch_upserted_samples(current_table_data, added_sample_ids))
 
     except Exception as e:
         print(f"Error in upload_data callback processing file: {e}") # Log parsing error
-        return html.Div(f'There was an error processing this file: {e}', className='text-red-600')
+        return html.Div(f'There was an error processing this file: {e}', className='text-red-600'), dash.no_update
 
 
 # Callback for Deleting Samples by ID (Comma-separated list)
 @app.callback(
     Output('output-delete-status', 'children'), # Output to the dedicated Div
+    Output('full-dataset-table', 'data', allow_duplicate=True), # Patch out just the deleted rows
     Input('delete-samples-by-id-button', 'n_clicks'), # Button for ID deletion
     State('delete-sample-ids', 'value'), # Input for comma-separated IDs
+    State('full-dataset-table', 'data'),
     prevent_initial_call=True
 )
-def delete_samples_by_id(n_clicks, sample_ids_str):
+def delete_samples_by_id(n_clicks, sample_ids_str, current_table_data):
     if n_clicks is None or n_clicks == 0:
-        return ""
+        return "", dash.no_update
 
     if not sample_ids_str:
-        return html.Div("Please enter sample IDs to delete.", className='text-yellow-600')
+        return html.Div("Please enter sample IDs to delete.", className='text-yellow-600'), dash.no_update
 
     sample_ids = [s.strip() for s in sample_ids_str.split(',') if s.strip()]
     if not sample_ids:
-        return html.Div("Invalid input. Please enter valid comma-separated sample IDs.", className='text-red-600')
+        return html.Div("Invalid input. Please enter valid comma-separated sample IDs.", className='text-red-600'), dash.no_update
 
+    table_update = dash.no_update
     conn = database.get_db_connection()
     try:
         deleted_count = database.bulk_delete_samples(conn, sample_ids)
         if deleted_count > 0:
             message = html.Div(f"Successfully deleted {deleted_count} samples.", className='text-green-600')
+            table_update = _patch_removed_samples(current_table_data, sample_ids)
         else:
             message = html.Div(f"No samples found with the provided IDs: {', '.join(sample_ids)}.", className='text-yellow-600')
     except Exception as e:
         print(f"Error in delete_samples_by_id callback: {e}") # Log the error
         message = html.Div(f"Error deleting samples: {e}", className='text-red-600')
-    finally:
-        conn.close()
 
-    return message
+    return message, table_update
 
 
 # Callback for Adding a New Row to the Full Dataset Table
@@ -376,26 +727,24 @@ def add_row_to_table(n_clicks, current_table_data, page_size):
     if n_clicks is None or n_clicks == 0:
         return dash.no_update, dash.no_update, dash.no_update
 
-    # Get current columns (now sample is editable)
-    columns_info = get_initial_table_columns() # Use the helper function
+    # Create an empty dictionary for a new row (now sample is editable)
+    new_row = {col_dict['id']: None for col_dict in _COLUMN_SPEC}
 
-    # Initialize rows if it's the first add or table was empty
-    if current_table_data is None:
-        rows = []
+    # Send only the new row: a Patch appends it on the client instead of the whole table
+    # making a round trip. The columns are the static spec the table already has.
+    num_rows = len(current_table_data) if current_table_data else 0
+    if current_table_data is None: # Nothing on the client to patch yet
+        table_update = [new_row]
     else:
-        rows = list(current_table_data) # Create a mutable list from current data
+        table_update = Patch()
+        table_update.append(new_row)
 
-    # Create an empty dictionary for a new row
-    new_row = {col_dict['id']: None for col_dict in columns_info}
-
-    rows.append(new_row)
-    
     # Calculate the page number for the newly added row
     # page_current is 0-indexed, page_size is the number of rows per page
-    new_page_current = math.ceil(len(rows) / page_size) - 1
+    new_page_current = math.ceil((num_rows + 1) / page_size) - 1
     new_page_current = max(0, new_page_current) # Ensure it's not negative if table is empty
 
-    return rows, columns_info, new_page_current
+    return table_update, dash.no_update, new_page_current
 
 
 # Callback for Deleting Selected Rows from the Table (using checkboxes)
@@ -426,11 +775,13 @@ def delete_selected_rows_from_table(n_clicks, current_table_data, selected_rows)
     try:
         deleted_count = database.bulk_delete_samples(conn, samples_to_delete)
         if deleted_count > 0:
-            # Filter out the deleted rows from the current table data
-            # Use original index of selected_rows to remove them correctly
-            updated_table_data = [row for i, row in enumerate(current_table_data) if i not in selected_rows]
+            # Remove the selected rows on the client with a Patch of index deletions instead of
+            # resending the filtered table; highest index first so the lower ones stay valid
+            table_patch = Patch()
+            for i in sorted(set(selected_rows), reverse=True):
+                del table_patch[i]
             message = html.Div(f"Successfully deleted {deleted_count} selected samples.", className='text-green-600')
-            return message, updated_table_data
+            return message, table_patch
         else:
             message = html.Div(f"Could not find selected samples in the database to delete.", className='text-yellow-600')
             return message, dash.no_update
@@ -438,8 +789,22 @@ def delete_selected_rows_from_table(n_clicks, current_table_data, selected_rows)
         print(f"Error in delete_selected_rows_from_table callback: {e}")
         message = html.Div(f"Error deleting selected samples: {e}", className='text-red-600')
         return message, dash.no_update
-    finally:
-        conn.close()
+
+# Fields checked by handle_table_edits; changes to any other row keys can't change its messages
+# Field rules shared by the edit warnings and the save-time validation of new rows
+REQUIRED_STR_COLS = ('sample', 'subject', 'project', 'condition', 'treatment', 'sample_type', 'sex')
+REQUIRED_NUM_COLS = ('b_cell', 'cd8_t_cell', 'cd4_t_cell', 'nk_cell', 'monocyte')
+OPTIONAL_NUM_COLS = ('age', 'time_from_treatment_start')
+VALID_RESPONSES = frozenset({'y', 'n', ''}) # After lower() and strip(); missing is also allowed
+
+_VALIDATED_TABLE_FIELDS = REQUIRED_STR_COLS + REQUIRED_NUM_COLS + OPTIONAL_NUM_COLS + ('response',)
+
+# Most validation messages shown under the table at once; the rest are summarized in one line
+MAX_EDIT_MESSAGES = 50
+
+def _validated_values(rows):
+    """The validated fields of each table row, as a list of tuples for cheap comparison."""
+    return [tuple(row.get(field) for field in _VALIDATED_TABLE_FIELDS) for row in rows]
 
 # Callback for Client-Side Validation on Table Edits
 @app.callback(
@@ -455,94 +820,135 @@ def handle_table_edits(data, data_previous):
     if data_previous is None:
         return "" # No initial message
 
+    # The data prop also fires for updates written by other callbacks; when nothing that is
+    # validated changed, the current messages still hold, so skip the DataFrame + validation pass
+    if data == data_previous or (data and data_previous and
+                                 _validated_values(data) == _validated_values(data_previous)):
+        return dash.no_update
+
     df_current = pd.DataFrame(data)
-    # Ensure df_previous is a DataFrame, even if data_previous is None, to avoid errors in comparisons
-    df_previous = pd.DataFrame(data_previous) if data_previous else pd.DataFrame(columns=df_current.columns)
+    # Only the previous sample IDs are needed (to tell new rows apart), so they are collected
+    # straight from the row dicts into a set rather than building a DataFrame of the previous table
+    previous_sample_ids = frozenset(
+        str(row['sample']) for row in data_previous if row.get('sample') is not None)
 
     message_list = [] # Collect all validation messages
 
-    # Perform client-side validation for all rows (new and existing)
-    for idx, row in df_current.iterrows():
-        # Robustly get sample ID for messages, default to 'New Row' and strip whitespace
-        current_sample_id_for_msg = str(row.get('sample', 'New Row')).strip()
-        if not current_sample_id_for_msg: # If it's empty after strip, use a placeholder for message
-            current_sample_id_for_msg = 'New Row (ID missing)'
-
-        # Determine if it's a new row by checking if its 'sample' ID exists in the previous data.
-        is_new_row = True
-        if 'sample' in df_previous.columns and not df_previous.empty:
-            # Convert previous IDs to string for robust comparison
-            previous_sample_ids_str_series = df_previous['sample'].dropna().astype(str)
-            if current_sample_id_for_msg in previous_sample_ids_str_series.values:
-                is_new_row = False
-
-        # Validation for required fields
-        required_str_cols = ['sample', 'subject', 'project', 'condition', 'treatment', 'sample_type', 'sex']
-        required_num_cols = ['b_cell', 'cd8_t_cell', 'cd4_t_cell', 'nk_cell', 'monocyte']
-        optional_num_cols = ['age', 'time_from_treatment_start']
-
-        # Ensure sample ID is not empty for new rows (this is a critical check for saving later)
-        if is_new_row and (pd.isna(row.get('sample')) or current_sample_id_for_msg == 'New Row (ID missing)'):
-            message_list.append(str((f"Warning: Sample '{current_sample_id_for_msg}' - 'sample' ID cannot be empty for a new row. Please provide a unique ID.")))
-        
-        # Check for empty strings in required string fields
-        for col in required_str_cols:
-            if col in row: # Ensure the column exists in the row dictionary
-                # Explicitly convert to string and strip whitespace for emptiness check
-                val_str = str(row.get(col, '')).strip() 
-                if val_str == '':
-                    message_list.append(str(f"Warning: Sample '{current_sample_id_for_msg}' - '{col}' cannot be empty."))
-        
-        # Check for numeric types in required numeric fields (cell counts)
-        for col in required_num_cols:
-            val = row.get(col)
-            # Coerce to numeric; if it becomes NaN, it's not a valid number
-            coerced_val = pd.to_numeric(val, errors='coerce')
-            if pd.isna(coerced_val):
-                # Robustly convert original value to string for message
-                # Using repr() for values that might be complex objects (like pd.NA) to get a safe string representation
-                original_val_str = repr(val) if pd.isna(val) else str(val) 
-                message_list.append(str(f"Warning: Sample '{current_sample_id_for_msg}' - '{col}' ('{original_val_str}') must be a numeric value."))
-
-        # Check for numeric types in optional numeric fields if values are present
-        for col in optional_num_cols:
-            val = row.get(col)
-            if pd.notna(val): # Only validate if not NaN
-                coerced_val = pd.to_numeric(val, errors='coerce')
-                if pd.isna(coerced_val): # If it couldn't be coerced to numeric, it's an error
-                    original_val_str = repr(val) if pd.isna(val) else str(val) # Robust conversion
-                    message_list.append(str(f"Warning: Sample '{current_sample_id_for_msg}' - '{col}' ('{original_val_str}') must be a numeric value if provided."))
-
-        # Specific validation for 'response' column
-        if 'response' in row: # Ensure the column exists
-            # Robustly convert value to string for comparison and message
-            response_val_raw = row.get('response')
-            response_val_display = str(response_val_raw).lower().strip() if pd.notna(response_val_raw) else ''
-            
-            if response_val_display not in ['y', 'n', ''] and pd.notna(response_val_raw):
-                message_list.append(str(f"Warning: Sample '{current_sample_id_for_msg}' - 'response' ('{response_val_display}') must be 'y', 'n', or empty."))
-        
-        # Check for duplicate sample IDs within the current UI table (before saving to DB)
-        # Only check if the sample ID is not empty, as empty IDs are often temporary for new rows
-        if current_sample_id_for_msg and current_sample_id_for_msg != 'New Row (ID missing)' and 'sample' in df_current.columns:
-            # Create a Series of string-converted sample IDs for robust duplication check
-            sample_ids_as_str_series = df_current['sample'].dropna().astype(str)
-            # Count occurrences of the current ID
-            if (sample_ids_as_str_series == current_sample_id_for_msg).sum() > 1:
-                message_list.append(str(f"Warning: Sample ID '{current_sample_id_for_msg}' is duplicated in the table. It must be unique to save."))
-
-    # Use set() to remove duplicate messages, then convert to list of html.Li components.
-    # Sorting ensures consistent order of messages displayed in the UI.
+    # Perform client-side validation for all rows (new and existing), one whole-column check
+    # at a time instead of iterating the rows; messages are only formatted for flagged rows
+    missing_column = pd.Series([None] * len(df_current), index=df_current.index, dtype=object)
+
+    # Robustly get sample IDs for messages, default to 'New Row' and strip whitespace;
+    # IDs that are empty after the strip get a placeholder for messages
+    if 'sample' in df_current.columns:
+        sample_values = df_current['sample']
+        sample_ids_for_msg = sample_values.map(str).str.strip()
+    else:
+        sample_values = missing_column
+        sample_ids_for_msg = pd.Series('New Row', index=df_current.index, dtype=object)
+    id_missing = sample_ids_for_msg.eq('')
+    sample_ids_for_msg = sample_ids_for_msg.mask(id_missing, 'New Row (ID missing)')
+
+    # A row is new if its 'sample' ID does not exist in the previous data (compared as strings)
+    is_new_row = ~sample_ids_for_msg.isin(previous_sample_ids)
+
+    # Ensure sample ID is not empty for new rows (this is a critical check for saving later)
+    for sample_id in sample_ids_for_msg[is_new_row & (sample_values.isna() | id_missing)]:
+        message_list.append(f"Warning: Sample '{sample_id}' - 'sample' ID cannot be empty for a new row. Please provide a unique ID.")
+
+    # Check for empty strings in required string fields
+    for col in REQUIRED_STR_COLS:
+        if col in df_current.columns:
+            empty = df_current[col].map(str).str.strip().eq('')
+            message_list.extend(f"Warning: Sample '{sample_id}' - '{col}' cannot be empty." for sample_id in sample_ids_for_msg[empty])
+
+    # Check for numeric types in required numeric fields (cell counts): values that coerce to NaN
+    # are not valid numbers. Using repr() for missing values (like pd.NA) to get a safe string representation
+    for col in REQUIRED_NUM_COLS:
+        values = df_current[col] if col in df_current.columns else missing_column
+        invalid = pd.to_numeric(values, errors='coerce').isna()
+        message_list.extend(
+            f"Warning: Sample '{sample_id}' - '{col}' ('{repr(val) if pd.isna(val) else str(val)}') must be a numeric value."
+            for sample_id, val in zip(sample_ids_for_msg[invalid], values[invalid]))
+
+    # Check for numeric types in optional numeric fields if values are present
+    for col in OPTIONAL_NUM_COLS:
+        if col in df_current.columns:
+            values = df_current[col]
+            invalid = values.notna() & pd.to_numeric(values, errors='coerce').isna()
+            message_list.extend(
+                f"Warning: Sample '{sample_id}' - '{col}' ('{val}') must be a numeric value if provided."
+                for sample_id, val in zip(sample_ids_for_msg[invalid], values[invalid]))
+
+    # Specific validation for 'response' column
+    if 'response' in df_current.columns:
+        responses = df_current['response']
+        response_display = responses.map(str).str.lower().str.strip()
+        invalid = responses.notna() & ~response_display.isin(VALID_RESPONSES)
+        message_list.extend(
+            f"Warning: Sample '{sample_id}' - 'response' ('{response}') must be 'y', 'n', or empty."
+            for sample_id, response in zip(sample_ids_for_msg[invalid], response_display[invalid]))
+
+    # Check for duplicate sample IDs within the current UI table (before saving to DB).
+    # Only non-empty IDs are checked, as empty IDs are often temporary for new rows
+    if 'sample' in df_current.columns:
+        id_counts = sample_values.dropna().map(str).value_counts()
+        duplicated = ~id_missing & sample_ids_for_msg.map(id_counts).fillna(0).gt(1)
+        message_list.extend(
+            f"Warning: Sample ID '{sample_id}' is duplicated in the table. It must be unique to save."
+            for sample_id in sample_ids_for_msg[duplicated])
+
+    # Remove duplicate messages keeping first-seen order (no sort needed: the checks run in a fixed
+    # order), then convert to list of html.Li components, capped so a badly broken table doesn't
+    # produce thousands of DOM nodes.
     # CRITICAL FIX: Explicitly cast 'msg' to str to guarantee React compatibility.
-    for msg in message_list:
-        if not isinstance(msg, str):
-            print("Non-string in message_list:", msg, type(msg))
+    unique_messages = list(dict.fromkeys(message_list))
+    shown_messages = unique_messages[:MAX_EDIT_MESSAGES]
+    if len(unique_messages) > MAX_EDIT_MESSAGES:
+        shown_messages.append(f"... {len(unique_messages) - MAX_EDIT_MESSAGES} more warnings")
 
-    final_message_div_content = html.Ul([html.Li(str(msg)) for msg in sorted(list(set(message_list)))]) if message_list else ""
+    final_message_div_content = html.Ul([html.Li(str(msg)) for msg in shown_messages]) if message_list else ""
     
     # Only return the validation message div, not the data
     return html.Div(final_message_div_content, className='text-yellow-600' if message_list else '')
 
+def _validate_new_table_rows(df):
+    """
+    Server-side validation of rows about to be added from the table. Each check runs once per
+    column over the whole frame; raises ValueError describing the first offending row (and its
+    first failing field), as a row-by-row check would.
+    """
+    missing_column = pd.Series([None] * len(df), index=df.index, dtype=object)
+
+    def column(col):
+        return df[col] if col in df.columns else missing_column
+
+    # (failing-row mask, message template) per check, in the order they are reported
+    checks = []
+    for col in REQUIRED_STR_COLS:
+        values = column(col)
+        checks.append((values.isna() | values.map(str).str.strip().eq(''),
+                       f"Missing required text field '{col}' for new sample '{{}}'."))
+    for col in REQUIRED_NUM_COLS:
+        checks.append((pd.to_numeric(column(col), errors='coerce').isna(),
+                       f"Missing or invalid numeric value for '{col}' for new sample '{{}}'."))
+    for col in OPTIONAL_NUM_COLS:
+        values = column(col)
+        checks.append((values.notna() & pd.to_numeric(values, errors='coerce').isna(),
+                       f"Invalid numeric value for optional field '{col}' for new sample '{{}}'."))
+    if 'response' in df.columns:
+        responses = df['response']
+        checks.append((responses.notna() & ~responses.map(str).str.lower().str.strip().isin(VALID_RESPONSES),
+                       "Invalid value for 'response' for new sample '{}'. Must be 'y', 'n', or empty."))
+
+    failing = np.column_stack([mask.to_numpy(dtype=bool) for mask, _ in checks])
+    bad_rows = np.flatnonzero(failing.any(axis=1))
+    if len(bad_rows):
+        row_position = bad_rows[0]
+        _, message = checks[int(np.argmax(failing[row_position]))]
+        sample_id = df['sample'].iloc[row_position] if 'sample' in df.columns else 'N/A'
+        raise ValueError(message.format(sample_id))
+
 # CALLBACK: To Save All Changes from the Table to the Database
 @app.callback(
     Output('output-table-edit-status', 'children', allow_duplicate=True), # Status message
@@ -566,140 +972,117 @@ def save_table_changes(n_clicks, current_table_data, previous_table_data):
     message_list = []
     db_write_occurred = False
 
+    # Sample IDs on each side, split once into new / kept / removed with hash-based Index set
+    # operations (kept in table order) instead of rescanning the tables per sample
+    current_ids = pd.Index(df_current['sample'].dropna().unique())
+    previous_ids = pd.Index(df_previous['sample'].dropna().unique())
+    new_sample_ids = current_ids.difference(previous_ids, sort=False)
+    common_ids = previous_ids.intersection(current_ids, sort=False)
+    deleted_sample_ids_ui = previous_ids.difference(current_ids, sort=False).tolist()
+
+    # The whole save is one transaction: the helpers run with commit=False and everything is
+    # committed once at the end (a single fsync), or rolled back together if any section fails,
+    # so a save is all-or-nothing. Success messages are only reported once the commit happened.
+    success_messages = []
+    saved_sample_ids = [] # Samples added or updated by this save, patched into the table afterwards
     try:
+        conn.execute("BEGIN IMMEDIATE") # Take the write lock up front rather than mid-save
+
         # --- Handle New Rows ---
-        # Find rows that are in current_table_data but not in previous_table_data (based on 'sample' ID)
-        new_sample_ids = df_current[~df_current['sample'].isin(df_previous['sample'])]['sample'].dropna().tolist()
-        
-        if new_sample_ids:
+        # Rows that are in current_table_data but not in previous_table_data (based on 'sample' ID)
+        if len(new_sample_ids):
             new_rows_to_add_df = df_current[df_current['sample'].isin(new_sample_ids)].copy()
             if not new_rows_to_add_df.empty:
                 try:
                     # Perform server-side validation for new rows before adding
-                    for idx, row in new_rows_to_add_df.iterrows():
-                        required_str_cols = ['sample', 'subject', 'project', 'condition', 'treatment', 'sample_type', 'sex']
-                        required_num_cols = ['b_cell', 'cd8_t_cell', 'cd4_t_cell', 'nk_cell', 'monocyte']
-                        optional_num_cols = ['age', 'time_from_treatment_start']
-
-                        for col in required_str_cols:
-                            if pd.isna(row.get(col)) or str(row.get(col, '')).strip() == '':
-                                raise ValueError(f"Missing required text field '{col}' for new sample '{row.get('sample', 'N/A')}'.")
-                        for col in required_num_cols:
-                             if pd.isna(row.get(col)) or not pd.api.types.is_numeric_dtype(pd.to_numeric(row.get(col), errors='coerce')):
-                                raise ValueError(f"Missing or invalid numeric value for '{col}' for new sample '{row.get('sample', 'N/A')}'.")
-                        for col in optional_num_cols:
-                            if pd.notna(row.get(col)) and not pd.api.types.is_numeric_dtype(pd.to_numeric(row.get(col), errors='coerce')):
-                                raise ValueError(f"Invalid numeric value for optional field '{col}' for new sample '{row.get('sample', 'N/A')}'.")
-                        response_val = str(row.get('response', '')).lower().strip()
-                        if response_val not in ['y', 'n', ''] and pd.notna(row.get('response')):
-                            raise ValueError(f"Invalid value for 'response' for new sample '{row.get('sample', 'N/A')}'. Must be 'y', 'n', or empty.")
-                    
-                    database.bulk_add_data(conn, new_rows_to_add_df)
-                    message_list.append(f"Successfully added {len(new_rows_to_add_df)} new sample(s).")
-                    db_write_occurred = True
+                    _validate_new_table_rows(new_rows_to_add_df)
+
+                    database.bulk_add_data(conn, new_rows_to_add_df, commit=False)
+                    success_messages.append(f"Successfully added {len(new_rows_to_add_df)} new sample(s).")
+                    saved_sample_ids.extend(new_sample_ids)
                 except sqlite3.IntegrityError as e:
                     message_list.append(f"Database Error adding new sample(s): {e}. Ensure Sample IDs are unique and valid foreign keys exist.")
-                    conn.rollback()
                 except ValueError as e:
                     message_list.append(f"Validation Error adding new sample(s): {e}.")
-                    conn.rollback()
                 except Exception as e:
                     message_list.append(f"Unexpected error adding new sample(s): {e}.")
-                    conn.rollback()
 
 
         # --- Handle Edited Existing Rows ---
-        # Iterate over samples that existed in the previous state
-        for previous_sample_id in df_previous['sample'].unique():
-            if previous_sample_id in df_current['sample'].values:
-                # This sample still exists in the current UI data
-                current_row = df_current[df_current['sample'] == previous_sample_id].iloc[0]
-                previous_row = df_previous[df_previous['sample'] == previous_sample_id].iloc[0]
-
-                updates_needed = False
-                for col in df_current.columns:
-                    current_val = current_row[col]
-                    previous_val = previous_row[col]
-
-                    # Robust comparison, especially for NaNs and types
-                    if pd.isna(current_val) and pd.isna(previous_val):
-                        continue # No change if both are NaN
-                    elif str(current_val) != str(previous_val):
-                        updates_needed = True
-                        break # Changes detected
-
-                if updates_needed:
-                    try:
-                        # If the sample ID itself was changed for an existing row:
-                        # This scenario means the user edited the 'sample' column for an existing record.
-                        # We treat this as a delete of the old record and insert of the new one.
-                        if str(current_row['sample']) != str(previous_row['sample']):
-                            old_id = previous_row['sample']
-                            new_id = current_row['sample']
-                            
-                            # Validate the new ID before trying to delete/add
-                            if pd.isna(new_id) or str(new_id).strip() == '':
-                                raise ValueError(f"Cannot change sample ID from '{old_id}' to empty. New ID must be provided.")
-
-                            # Delete the old record
-                            database.bulk_delete_samples(conn, [old_id])
-                            message_list.append(f"Info: Old sample '{old_id}' deleted during ID change to '{new_id}'.")
-                            
-                            # Add the new record (this will handle samples, subjects, projects, cell_counts)
-                            database.bulk_add_data(conn, pd.DataFrame([current_row.to_dict()]))
-                            message_list.append(f"Successfully re-added sample with new ID '{new_id}'.")
-                            db_write_occurred = True
-
-                        else: # Sample ID itself was NOT changed, just other fields
-                            # Pass the entire row to bulk_add_data.
-                            # bulk_add_data uses INSERT OR REPLACE for samples, which will update existing records.
-                            # It also uses INSERT OR IGNORE for projects/subjects for consistency.
-                            database.bulk_add_data(conn, pd.DataFrame([current_row.to_dict()]))
-                            message_list.append(f"Successfully updated sample '{current_row['sample']}'.")
-                            db_write_occurred = True
-                        
-                    except sqlite3.IntegrityError as e:
-                        message_list.append(f"Database Error updating sample '{current_row['sample']}': {e}. Ensure Sample IDs are unique and foreign keys are valid.")
-                        conn.rollback()
-                    except ValueError as e:
-                        message_list.append(f"Validation Error updating sample '{current_row['sample']}': {e}.")
-                        conn.rollback()
-                    except Exception as e:
-                        message_list.append(f"Unexpected error updating sample '{current_row['sample']}': {e}.")
-                        conn.rollback()
+        # Samples that existed in the previous state and still exist in the current UI data,
+        # compared in one aligned frame (first row per sample ID on each side).
+        # (An edited 'sample' ID shows up as a new row plus a removed row, handled by the other sections.)
+        if len(common_ids) and not message_list:
+            columns = df_current.columns
+            current_rows = df_current.drop_duplicates('sample').set_index('sample', drop=False).loc[common_ids, columns]
+            previous_rows = (df_previous.drop_duplicates('sample').set_index('sample', drop=False)
+                             .loc[common_ids].reindex(columns=columns))
+            # One elementwise numpy pass over the aligned values (no per-cell str() copies);
+            # a field that is missing on both sides (None/NaN) is not a change
+            current_values = current_rows.to_numpy(dtype=object)
+            previous_values = previous_rows.to_numpy(dtype=object)
+            both_missing = pd.isna(current_values) & pd.isna(previous_values)
+            changed = ((current_values != previous_values) & ~both_missing).any(axis=1)
+            edited_rows_df = current_rows[changed].reset_index(drop=True)
+
+            if not edited_rows_df.empty:
+                try:
+                    # All edited rows go to bulk_add_data in one call; it uses INSERT OR REPLACE for
+                    # samples, which will update existing records, and INSERT OR IGNORE for
+                    # projects/subjects for consistency.
+                    database.bulk_add_data(conn, edited_rows_df, commit=False)
+                    success_messages.extend(f"Successfully updated sample '{sample_id}'." for sample_id in edited_rows_df['sample'])
+                    saved_sample_ids.extend(edited_rows_df['sample'])
+                except sqlite3.IntegrityError as e:
+                    message_list.append(f"Database Error updating sample(s): {e}. Ensure Sample IDs are unique and foreign keys are valid.")
+                except ValueError as e:
+                    message_list.append(f"Validation Error updating sample(s): {e}.")
+                except Exception as e:
+                    message_list.append(f"Unexpected error updating sample(s): {e}.")
 
         # --- Handle Deleted Rows (from UI, not explicit Delete button) ---
         # These are rows in previous_table_data but not in current_table_data
-        deleted_sample_ids_ui = [
-            s_id for s_id in df_previous['sample'].unique()
-            if s_id not in df_current['sample'].values and pd.notna(s_id)
-        ]
-        
-        if deleted_sample_ids_ui:
+        if deleted_sample_ids_ui and not message_list:
             try:
-                deleted_count = database.bulk_delete_samples(conn, deleted_sample_ids_ui)
+                deleted_count = database.bulk_delete_samples(conn, deleted_sample_ids_ui, commit=False)
                 if deleted_count > 0:
-                    message_list.append(f"Successfully deleted {deleted_count} sample(s) that were removed from the table.")
-                    db_write_occurred = True
+                    success_messages.append(f"Successfully deleted {deleted_count} sample(s) that were removed from the table.")
             except Exception as e:
                 message_list.append(f"Error deleting samples removed from UI: {e}")
-                conn.rollback()
+
+        if message_list: # A section failed: nothing from this save is kept
+            conn.rollback()
+            message_list.append("No changes were saved.")
+            saved_sample_ids = None
+        else:
+            conn.commit()
+            message_list = success_messages
+            db_write_occurred = bool(success_messages)
 
     except Exception as e:
         print(f"Unhandled error in save_table_changes outer try-catch: {e}")
         conn.rollback()
         return html.Div(f"An unhandled error occurred during saving: {e}", className='text-red-600'), dash.no_update
     finally:
-        conn.close()
+        database.bump_data_version()
 
     final_message_div_content = html.Ul([html.Li(str(msg)) for msg in message_list]) if message_list else ""
 
-    # Always trigger a refresh of the table data from the database after saving
-    # This ensures the table reflects the true saved state and all validations.
-    # It also handles re-sorting.
-    updated_df_from_db = get_all_data_for_display()
+    # After a successful save the table already shows the user's rows, so only the saved samples
+    # are re-read and patched in with their stored values (e.g. missing counts become 0); removed
+    # samples are already gone from the table. The whole table is reloaded from the database
+    # (the true saved state) only when the table does not match it row for row: after a rolled
+    # back save, or when rows without a sample ID or with a repeated one were not saved as shown.
+    table_sample_ids = df_current['sample']
+    if (saved_sample_ids is None or table_sample_ids.isna().any()
+            or table_sample_ids.duplicated().any()):
+        table_update = get_all_data_records()
+    elif saved_sample_ids:
+        table_update = _patch_upserted_samples(current_table_data, saved_sample_ids)
+    else:
+        table_update = dash.no_update
     
-    return html.Div(final_message_div_content, className='text-green-600' if db_write_occurred and not any("Error" in msg for msg in message_list) else 'text-red-600'), updated_df_from_db.to_dict('records')
+    return html.Div(final_message_div_content, className='text-green-600' if db_write_occurred and not any("Error" in msg for msg in message_list) else 'text-red-600'), table_update
 
 
 # Callback to Refresh the Full Dataset Table (manually via button click)
@@ -716,45 +1099,122 @@ def refresh_full_dataset_table(n_clicks_refresh): # Function now correctly expec
     if n_clicks_refresh is None or n_clicks_refresh == 0:
         return dash.no_update, dash.no_update
     
-    updated_df = get_all_data_for_display() # This will get the data sorted by sample_id ASC
+    updated_records = get_all_data_records() # This will get the data sorted by sample_id ASC
     
     # Use the helper function to get columns, ensuring sample is editable
     columns = get_initial_table_columns() 
     
-    return updated_df.to_dict('records'), columns
-
-# Callback to refresh the Relative Frequencies Summary Table
+    return updated_records, columns
+
+# Dash DataTable filter syntax -> (column, operator) for database.fetch_rel_freq_page.
+# Longer operators come first so e.g. 'ge ' is not matched as '>' and then garbage.
+_TABLE_FILTER_OPERATORS = [
+    (['ge ', '>='], '>='),
+    (['le ', '<='], '<='),
+    (['lt ', '<'], '<'),
+    (['gt ', '>'], '>'),
+    (['ne ', '!='], '!='),
+    (['eq ', '='], '='),
+    (['contains '], 'contains'),
+    (['datestartswith '], 'startswith'),
+]
+
+def _parse_table_filter_query(filter_query):
+    """
+    Splits a DataTable filter_query (e.g. '{population} contains "cd4" && {count} > 100')
+    into (column, operator, value) triples. Unrecognized parts are skipped.
+    """
+    filters = []
+    for filter_part in (filter_query or '').split(' && '):
+        for operator_tokens, operator in _TABLE_FILTER_OPERATORS:
+            token = next((t for t in operator_tokens if t in filter_part), None)
+            if token is None:
+                continue
+            name_part, value_part = filter_part.split(token, 1)
+            name = name_part[name_part.find('{') + 1: name_part.rfind('}')]
+            value_part = value_part.strip()
+            if value_part and value_part[0] == value_part[-1] and value_part[0] in ("'", '"', '`') and len(value_part) > 1:
+                value = value_part[1:-1].replace('\\' + value_part[0], value_part[0])
+            else:
+                try:
+                    value = float(value_part)
+                except ValueError:
+                    value = value_part
+            if name in database.rel_freq_page_columns:
+                filters.append((name, operator, value))
+            break
+    return filters
+
+# Callback serving the Relative Frequencies Summary Table one page at a time
 @app.callback(
-    Output('relative-frequencies-table', 'data', allow_duplicate=True),
+    Output('relative-frequencies-table', 'data'),
+    Output('relative-frequencies-table', 'page_count'),
+    Input('relative-frequencies-table', 'page_current'),
+    Input('relative-frequencies-table', 'page_size'),
+    Input('relative-frequencies-table', 'sort_by'),
+    Input('relative-frequencies-table', 'filter_query'),
     Input('refresh-data-button', 'n_clicks'), # Keep its own refresh button
     Input('refresh-data-table-button', 'n_clicks'), # Trigger when main data table is refreshed
-    prevent_initial_call=True # Only runs when a button is clicked
 )
-def refresh_relative_frequencies_table_data(refresh_n_rel_freq, refresh_n_main_table): # Update function signature
-    """Refreshes the data in the relative frequencies table using analysis.get_relative_frequency."""
-    # This callback is explicitly triggered by the 'Refresh Relative Frequencies' button
-    # or by the 'Refresh Data Table' button in the data management section.
-
-    # Check which input triggered the callback
-    ctx = dash.callback_context
-    if not ctx.triggered: # Should be prevented by prevent_initial_call=True
-        return dash.no_update
-
-    trigger_id = ctx.triggered[0]['prop_id'].split('.')[0]
-    
-    # If it's the initial (0 or None) click for either button, don't update unless explicitly clicked later
-    if (trigger_id == 'refresh-data-button' and (refresh_n_rel_freq is None or refresh_n_rel_freq == 0)) or \
-       (trigger_id == 'refresh-data-table-button' and (refresh_n_main_table is None or refresh_n_main_table == 0)):
-        return dash.no_update
+def update_relative_frequencies_page(page_current, page_size, sort_by, filter_query,
+                                     refresh_n_rel_freq, refresh_n_main_table):
+    """
+    Queries the current page of the relative frequencies table with database.fetch_rel_freq_page.
+    Runs on load, on paging/sorting/filtering, and when either refresh button is clicked
+    (the page is simply re-read from the database).
+    """
+    page_current = page_current or 0
+    page_size = page_size or 10
+    sort_terms = [(s['column_id'], s['direction'] == 'asc') for s in (sort_by or [])
+                  if s.get('column_id') in database.rel_freq_page_columns]
 
-    all_data_df_wide = get_all_data_for_display() # Get latest wide-format data
-    rel_freq_df = analysis.get_relative_frequency(all_data_df_wide) # Use analysis.get_relative_frequency
-    
-    if rel_freq_df.empty:
-        return []
-    
-    return rel_freq_df.to_dict('records')
+    try:
+        page_df, total_rows = database.fetch_rel_freq_page(
+            page_current * page_size, page_size, sort_terms, _parse_table_filter_query(filter_query))
+    except Exception as e:
+        print(f"Error fetching relative frequencies page: {e}")
+        return [], 1
+
+    # Narrow dtypes and round the percentage for display: shorter JSON numbers on the wire
+    page_df = page_df.astype({'total_count': 'int32', 'count': 'int32'})
+    page_df['percentage'] = np.round(page_df['percentage'].to_numpy(dtype=float), 2)
+    return df_to_records(page_df), max(1, math.ceil(total_rows / page_size))
+
+
+# Box traces from server-side summary statistics: the figure carries five numbers per group
+# (plus any outliers) instead of every data point, so its payload doesn't grow with the cohort.
+# Layout of the response comparison figure; it never changes, so it is built once here
+RESPONSE_BOXPLOT_LAYOUT = dict(
+    font_family="Inter",
+    margin=dict(l=20, r=20, t=50, b=20),
+    height=350,
+    showlegend=False
+)
 
+def _precomputed_box_traces(values, name, color):
+    """
+    Returns the plotly traces for one box: a go.Box built from quartiles and Tukey fences
+    (1.5 IQR, as plotly computes them), and a marker trace for points beyond the fences.
+    """
+    import plotly.graph_objects as go # Deferred to first use (cached by Python after that)
+
+    values = np.asarray(values, dtype=float)
+    q1, median, q3 = np.quantile(values, [0.25, 0.5, 0.75])
+    iqr = q3 - q1
+    lowerfence = values[values >= q1 - 1.5 * iqr].min()
+    upperfence = values[values <= q3 + 1.5 * iqr].max()
+    traces = [go.Box(
+        x=[name], q1=[q1], median=[median], q3=[q3],
+        lowerfence=[lowerfence], upperfence=[upperfence],
+        name=name, marker_color=color, boxpoints=False
+    )]
+    outliers = values[(values < lowerfence) | (values > upperfence)]
+    if outliers.size:
+        traces.append(go.Scatter(
+            x=[name] * outliers.size, y=outliers, mode='markers',
+            name=name, marker_color=color, hoverinfo='y'
+        ))
+    return traces
 
 # Callback for Response Comparison Analysis
 @app.callback(
@@ -769,57 +1229,56 @@ def run_response_analysis(n_clicks_run, n_clicks_refresh_main_table): # Update f
     # It is explicitly triggered by the 'Run Response Comparison' button
     # or by the 'Refresh Data Table' button in the data management section.
 
-    ctx = dash.callback_context
-    if not ctx.triggered:
-        return html.Div("Click 'Run Response Comparison' to analyze.", className='text-gray-500'), html.Div()
-
-    trigger_id = ctx.triggered[0]['prop_id'].split('.')[0]
-
-    # If it's the initial (0 or None) click for either button, don't update unless explicitly clicked later
-    if (trigger_id == 'run-response-analysis-button' and (n_clicks_run is None or n_clicks_run == 0)) or \
-       (trigger_id == 'refresh-data-table-button' and (n_clicks_refresh_main_table is None or n_clicks_refresh_main_table == 0)):
-        return html.Div("Click 'Run Response Comparison' to analyze.", className='text-gray-500'), html.Div()
+    # prevent_initial_call skips the page-load call. A table refresh only re-runs the analysis
+    # once it has been run at least once; otherwise the output is left untouched (no recompute).
+    if not n_clicks_run:
+        return dash.no_update, dash.no_update
 
-    # Get the latest data for analysis (wide format)
-    all_data_df_wide = get_all_data_for_display()
-    
-    # Convert to the long format with relative frequencies using analysis.get_relative_frequency
-    all_data_df_long = analysis.get_relative_frequency(all_data_df_wide)
+    # Get the latest data in long format, with relative frequencies computed in SQL
+    # (shared cached frame; analysis only reads it)
+    all_data_df_long = get_relative_frequency_long()
 
     if all_data_df_long.empty:
         return html.Div("No data available for response comparison.", className='text-red-500'), html.Div()
 
     filtered_df, stats_results = analysis.analyze_melanoma_tr1_response(all_data_df_long)
 
-    # Generate the list of dcc.Graph components
+    # Generate the boxplot figure (and notes for populations without enough data)
     figures_list = []
     if not filtered_df.empty:
         # These population names must match what's in your 'population' column after melting
         cell_populations = ['b_cell', 'cd8_t_cell', 'cd4_t_cell', 'nk_cell', 'monocyte']
-        for pop in cell_populations:
-            pop_data = filtered_df[filtered_df['population'] == pop]
-            # Only generate plot if there's sufficient data for the population
-            # (e.g., at least one responder and one non-responder value, or more than 1 overall point for visual)
-            if not pop_data.empty and pop_data['response'].nunique() > 1 and len(pop_data['percentage'].dropna()) >= 2 :
-                fig = px.box(
-                    pop_data,
-                    x='response',
-                    y='percentage',
-                    color='response',
-                    title=f'{pop} Relative Frequency',
-                    labels={'response': 'Treatment Response', 'percentage': 'Relative Frequency (%)'},
-                    color_discrete_map={'y': '#3B82F6', 'n': '#EF4444'}
-                )
-                fig.update_layout(
-                    title_x=0.5,
-                    font_family="Inter",
-                    margin=dict(l=20, r=20, t=50, b=20),
-                    height=300,
-                    showlegend=False
-                )
-                figures_list.append(dcc.Graph(figure=fig, className='w-full lg:w-1/5 xl:w-1/5 p-2'))
+        response_colors = {'y': '#3B82F6', 'n': '#EF4444'}
+        # Split the filtered frame once into (population, response) -> percentage arrays,
+        # instead of rescanning it with a boolean filter per population and response
+        groups = {
+            key: values.dropna().to_numpy()
+            for key, values in filtered_df.groupby(
+                ['population', 'response'], observed=True, sort=False)['percentage']
+        }
+        # All populations go into one figure (one subplot column each), so the browser sets up a
+        # single plotly.js graph instead of five
+        from plotly.subplots import make_subplots # Deferred to first use
+        fig = make_subplots(rows=1, cols=len(cell_populations), shared_yaxes=True,
+                            subplot_titles=[f'{pop} Relative Frequency' for pop in cell_populations])
+        insufficient_messages = []
+        for col_index, pop in enumerate(cell_populations, start=1):
+            pop_groups = {response: groups[(pop, response)] for response in response_colors
+                          if len(groups.get((pop, response), ())) > 0}
+            # Only generate plot if there's sufficient data for the population: at least one
+            # responder and one non-responder value. pop_groups only holds non-empty groups, so
+            # that also guarantees the 2 data points without summing the group sizes.
+            if len(pop_groups) > 1:
+                for response, response_values in pop_groups.items():
+                    fig.add_traces(_precomputed_box_traces(response_values, response, response_colors[response]),
+                                   rows=1, cols=col_index)
             else:
-                figures_list.append(html.Div(f"Insufficient data for {pop} boxplot (need at least 2 data points for different responses).", className='text-gray-500 p-2'))
+                insufficient_messages.append(html.Div(f"Insufficient data for {pop} boxplot (need at least 2 data points for different responses).", className='text-gray-500 p-2'))
+            fig.update_xaxes(title_text='Treatment Response', row=1, col=col_index)
+        fig.update_yaxes(title_text='Relative Frequency (%)', row=1, col=1)
+        fig.update_layout(**RESPONSE_BOXPLOT_LAYOUT)
+        figures_list.append(dcc.Graph(figure=fig, className='w-full p-2'))
+        figures_list.extend(insufficient_messages)
     
     # Generate statistical results display
     stat_output_elements = []
@@ -852,33 +1311,28 @@ def run_baseline_queries(n_clicks_run, n_clicks_refresh_main_table): # Update fu
     # It is explicitly triggered by the 'Run Baseline Queries' button
     # or by the 'Refresh Data Table' button in the data management section.
 
-    ctx = dash.callback_context
-    if not ctx.triggered:
-        return html.Div("Click 'Run Baseline Queries' to analyze.", className='text-gray-500')
-    
-    trigger_id = ctx.triggered[0]['prop_id'].split('.')[0]
-    if (trigger_id == 'run-baseline-queries-button' and (n_clicks_run is None or n_clicks_run == 0)) or \
-       (trigger_id == 'refresh-data-table-button' and (n_clicks_refresh_main_table is None or n_clicks_refresh_main_table == 0)):
-        return html.Div("Click 'Run Baseline Queries' to analyze.", className='text-gray-500')
-
-    # Get the latest data in wide format
-    all_data_df_wide = get_all_data_for_display()
+    # prevent_initial_call skips the page-load call. A table refresh only re-runs the queries
+    # once they have been run at least once; otherwise the output is left untouched (no recompute).
+    if not n_clicks_run:
+        return dash.no_update
 
-    if all_data_df_wide.empty:
+    # The filtering and counting run in SQLite (database.fetch_baseline_melanoma_tr1_counts),
+    # so only the small aggregate tables are read instead of the full wide table
+    try:
+        num_baseline_samples, aggregated_counts = database.fetch_baseline_melanoma_tr1_counts()
+    except Exception as e:
+        print(f"Error fetching baseline counts: {e}")
         return html.Div("No data available for baseline queries.", className='text-red-500')
 
-    # Pass the wide format DataFrame to analysis.query_baseline_melanoma_tr1_samples
-    baseline_samples_df, aggregated_counts = analysis.query_baseline_melanoma_tr1_samples(all_data_df_wide)
-
-    if baseline_samples_df.empty:
+    if num_baseline_samples == 0:
         return html.Div("No baseline melanoma PBMC samples with tr1 treatment found.", className='text-red-500')
     
     output_elements = [html.H3("Baseline Melanoma TR1 Sample Breakdown:", className='text-lg font-semibold text-gray-800 mb-2')]
-    output_elements.append(html.P(f"Total unique baseline samples: {baseline_samples_df['sample'].nunique()}", className='text-gray-700 mb-2'))
+    output_elements.append(html.P(f"Total unique baseline samples: {num_baseline_samples}", className='text-gray-700 mb-2'))
 
     output_elements.append(dash_table.DataTable(
         columns=[{"name": i, "id": i} for i in aggregated_counts['samples_per_project'].columns],
-        data=aggregated_counts['samples_per_project'].to_dict('records'),
+        data=df_to_records(aggregated_counts['samples_per_project']),
         style_table={'width': 'fit-content'},
         style_header={'backgroundColor': 'rgb(240, 240, 240)', 'fontWeight': 'bold'},
         style_cell={'textAlign': 'left', 'padding': '8px'}
@@ -887,7 +1341,7 @@ def run_baseline_queries(n_clicks_run, n_clicks_refresh_main_table): # Update fu
     output_elements.append(html.H4("Subjects by Response:", className='font-medium text-gray-700 mt-4'))
     output_elements.append(dash_table.DataTable(
         columns=[{"name": i, "id": i} for i in aggregated_counts['subject_response_counts'].columns],
-        data=aggregated_counts['subject_response_counts'].to_dict('records'),
+        data=df_to_records(aggregated_counts['subject_response_counts']),
         style_table={'width': 'fit-content'},
         style_header={'backgroundColor': 'rgb(240, 240, 240)', 'fontWeight': 'bold'},
         style_cell={'textAlign': 'left', 'padding': '8px'}
@@ -896,7 +1350,7 @@ def run_baseline_queries(n_clicks_run, n_clicks_refresh_main_table): # Update fu
     output_elements.append(html.H4("Subjects by Sex:", className='font-medium text-gray-700 mt-4'))
     output_elements.append(dash_table.DataTable(
         columns=[{"name": i, "id": i} for i in aggregated_counts['subject_sex_counts'].columns],
-        data=aggregated_counts['subject_sex_counts'].to_dict('records'),
+        data=df_to_records(aggregated_counts['subject_sex_counts']),
         style_table={'width': 'fit-content'},
         style_header={'backgroundColor': 'rgb(240, 240, 240)', 'fontWeight': 'bold'},
         style_cell={'textAlign': 'left', 'padding': '8px'}
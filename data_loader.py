@@ -1,11 +1,51 @@
 import pandas as pd
+from sqlalchemy import text
 from sqlalchemy.orm import sessionmaker
-from schema import init_db, Project, Subject, Sample, CellCount
+from schema import (init_db, refresh_wide_counts, Project, Subject, Sample, CellCount,
+                    SampleCellCountsWide, CELL_POPULATIONS)
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Populations in name order, the order the long-format frequency results are sorted in
+_SORTED_POPULATIONS = sorted(CELL_POPULATIONS)
+
+# Melanoma tr1 PBMC cell counts with each sample's total and the population percentages
+RESPONSE_COMPARISON_QUERY = text("""
+    SELECT 
+        s.response,
+        cc.population,
+        cc.count,
+        SUM(cc.count) OVER (PARTITION BY s.sample_id) as total_count,
+        (cc.count * 100.0 / SUM(cc.count) OVER (PARTITION BY s.sample_id)) as percentage
+    FROM samples s
+    JOIN cell_counts cc ON s.sample_id = cc.sample_id
+    WHERE s.sample_type = 'PBMC'
+        AND s.condition = 'melanoma'
+        AND s.treatment = 'tr1'
+    ORDER BY s.response, cc.population
+""")
+
+# Baseline (time 0) melanoma tr1 PBMC samples per project, response and sex
+BASELINE_MELANOMA_TR1_QUERY = text("""
+    SELECT 
+        p.project_id,
+        s.response,
+        sub.sex,
+        COUNT(DISTINCT s.sample_id) as sample_count,
+        COUNT(DISTINCT s.subject_id) as subject_count
+    FROM samples s
+    JOIN subjects sub ON s.subject_id = sub.subject_id
+    JOIN projects p ON sub.project_id = p.project_id
+    WHERE s.condition = 'melanoma'
+        AND s.treatment = 'tr1'
+        AND s.time_from_treatment_start = 0
+        AND s.sample_type = 'PBMC'
+    GROUP BY p.project_id, s.response, sub.sex
+    ORDER BY p.project_id, s.response, sub.sex
+""")
+
 class DataLoader:
     def __init__(self, db_url='sqlite:///cytometry.db'):
         self.engine = init_db(db_url)
@@ -13,85 +53,78 @@ class DataLoader:
     
     def load_csv(self, csv_path):
         """Load data from CSV file into the database."""
+        # Read CSV file
+        df = pd.read_csv(csv_path)
+        # NaN -> None so missing values bind as NULL
+        df = df.astype(object).where(df.notna(), None)
+
+        # One row per entity; the first occurrence in the CSV wins, and
+        # INSERT OR IGNORE keeps anything already in the database, matching
+        # the old query-then-add behaviour without a SELECT per row
+        projects = df[['project']].drop_duplicates('project').rename(
+            columns={'project': 'project_id'})
+        subjects = df[['subject', 'project', 'age', 'sex']].drop_duplicates('subject').rename(
+            columns={'subject': 'subject_id', 'project': 'project_id'})
+        samples = df[['sample', 'subject', 'condition', 'treatment', 'response',
+                      'sample_type', 'time_from_treatment_start']].drop_duplicates('sample').rename(
+            columns={'sample': 'sample_id', 'subject': 'subject_id'})
+        cell_counts = df[['sample', 'population', 'count']].rename(columns={'sample': 'sample_id'})
+
         try:
-            # Read CSV file
-            df = pd.read_csv(csv_path)
-            session = self.Session()
-            
-            # Process each row
-            for _, row in df.iterrows():
-                # Create or get project
-                project = session.query(Project).filter_by(project_id=row['project']).first()
-                if not project:
-                    project = Project(project_id=row['project'])
-                    session.add(project)
-                
-                # Create or get subject
-                subject = session.query(Subject).filter_by(subject_id=row['subject']).first()
-                if not subject:
-                    subject = Subject(
-                        subject_id=row['subject'],
-                        project_id=row['project'],
-                        age=row.get('age', None),
-                        sex=row.get('sex', None)
-                    )
-                    session.add(subject)
-                
-                # Create or get sample
-                sample = session.query(Sample).filter_by(sample_id=row['sample']).first()
-                if not sample:
-                    sample = Sample(
-                        sample_id=row['sample'],
-                        subject_id=row['subject'],
-                        condition=row['condition'],
-                        treatment=row['treatment'],
-                        response=row['response'],
-                        sample_type=row['sample_type'],
-                        time_from_treatment_start=row['time_from_treatment_start']
-                    )
-                    session.add(sample)
-                
-                # Create cell count
-                cell_count = CellCount(
-                    sample_id=row['sample'],
-                    population=row['population'],
-                    count=row['count']
-                )
-                session.add(cell_count)
-            
-            session.commit()
+            # Single transaction: one executemany per table instead of an ORM
+            # object and round-trip per CSV row. Core inserts still apply the
+            # created_at column defaults.
+            with self.engine.begin() as conn:
+                for table, frame in ((Project.__table__, projects),
+                                     (Subject.__table__, subjects),
+                                     (Sample.__table__, samples)):
+                    conn.execute(table.insert().prefix_with('OR IGNORE'),
+                                 frame.to_dict('records'))
+                conn.execute(CellCount.__table__.insert(), cell_counts.to_dict('records'))
+                refresh_wide_counts(conn, cell_counts['sample_id'])
+                # Refresh the planner statistics so the filters use the schema indexes
+                conn.exec_driver_sql('ANALYZE')
             logger.info(f"Successfully loaded data from {csv_path}")
-            
+
         except Exception as e:
-            session.rollback()
             logger.error(f"Error loading data: {str(e)}")
             raise
-        finally:
-            session.close()
     
     def get_cell_frequencies(self):
         """Calculate relative frequencies of cell populations for each sample."""
         session = self.Session()
         try:
-            # Get all cell counts with sample information
-            query = """
+            # One row per sample from the wide table, which already carries the total, so no
+            # window SUM over the long cell_counts rows
+            query = text(f"""
             SELECT 
                 s.sample_id,
                 s.sample_type,
-                cc.population,
-                cc.count,
-                SUM(cc.count) OVER (PARTITION BY s.sample_id) as total_count,
-                (cc.count * 100.0 / SUM(cc.count) OVER (PARTITION BY s.sample_id)) as percentage
+                {', '.join(f'w.{pop}' for pop in _SORTED_POPULATIONS)},
+                w.total
             FROM samples s
-            JOIN cell_counts cc ON s.sample_id = cc.sample_id
-            ORDER BY s.sample_id, cc.population
-            """
+            JOIN {SampleCellCountsWide.__tablename__} w ON s.sample_id = w.sample_id
+            ORDER BY s.sample_id
+            """)
             
             result = session.execute(query)
-            return pd.DataFrame(result.fetchall(), columns=[
-                'sample_id', 'sample_type', 'population', 'count', 
-                'total_count', 'percentage'
-            ])
+            wide = pd.DataFrame(result.fetchall(),
+                                columns=['sample_id', 'sample_type', *_SORTED_POPULATIONS, 'total_count'])
+            # Percentages for all populations in one vectorized division (count * 100.0 / total,
+            # as the SQL computed it), then laid out long: one row per (sample_id, population),
+            # ordered by sample_id and population
+            counts = wide[_SORTED_POPULATIONS]
+            percentages = counts.mul(100.0).div(wide['total_count'], axis=0)
+            n_pops = len(_SORTED_POPULATIONS)
+            # Low-cardinality labels are stored as categoricals
+            return pd.DataFrame({
+                'sample_id': wide['sample_id'].repeat(n_pops).to_numpy(),
+                'sample_type': pd.Categorical(wide['sample_type'].repeat(n_pops)),
+                'population': pd.Categorical(_SORTED_POPULATIONS * len(wide)),
+                'count': counts.to_numpy().ravel(),
+                'total_count': wide['total_count'].repeat(n_pops).to_numpy(),
+                'percentage': percentages.to_numpy().ravel(),
+            })
             
         finally:
             session.close()
@@ -100,25 +133,12 @@ class DataLoader:
         """Compare cell populations between responders and non-responders."""
         session = self.Session()
         try:
-            query = """
-            SELECT 
-                s.response,
-                cc.population,
-                cc.count,
-                SUM(cc.count) OVER (PARTITION BY s.sample_id) as total_count,
-                (cc.count * 100.0 / SUM(cc.count) OVER (PARTITION BY s.sample_id)) as percentage
-            FROM samples s
-            JOIN cell_counts cc ON s.sample_id = cc.sample_id
-            WHERE s.sample_type = 'PBMC'
-                AND s.condition = 'melanoma'
-                AND s.treatment = 'tr1'
-            ORDER BY s.response, cc.population
-            """
-            
-            result = session.execute(query)
+            result = session.execute(RESPONSE_COMPARISON_QUERY)
+            # Categorical response/population make the per-population filters in
+            # CytometryAnalysis integer-code compares instead of string compares
             return pd.DataFrame(result.fetchall(), columns=[
                 'response', 'population', 'count', 'total_count', 'percentage'
-            ])
+            ]).astype({'response': 'category', 'population': 'category'})
             
         finally:
             session.close()
@@ -127,25 +147,7 @@ class DataLoader:
         """Get baseline melanoma tr1 samples with demographic information."""
         session = self.Session()
         try:
-            query = """
-            SELECT 
-                p.project_id,
-                s.response,
-                sub.sex,
-                COUNT(DISTINCT s.sample_id) as sample_count,
-                COUNT(DISTINCT s.subject_id) as subject_count
-            FROM samples s
-            JOIN subjects sub ON s.subject_id = sub.subject_id
-            JOIN projects p ON sub.project_id = p.project_id
-            WHERE s.condition = 'melanoma'
-                AND s.treatment = 'tr1'
-                AND s.time_from_treatment_start = 0
-                AND s.sample_type = 'PBMC'
-            GROUP BY p.project_id, s.response, sub.sex
-            ORDER BY p.project_id, s.response, sub.sex
-            """
-            
-            result = session.execute(query)
+            result = session.execute(BASELINE_MELANOMA_TR1_QUERY)
             return pd.DataFrame(result.fetchall(), columns=[
                 'project_id', 'response', 'sex', 'sample_count', 'subject_count'
             ])
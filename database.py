@@ -1,162 +1,414 @@
 # database.py
+import re
 import sqlite3
+import threading
 import pandas as pd
 import os
 
 db_name = 'cell_counts.db'
+read_chunk_size = 200_000 # Rows fetched per chunk by the long-format relative frequency query
+data_version = 0 # Bumped after every committed write; lets callers cache query results per version
+
+def bump_data_version():
+    """
+    Marks the database contents as changed so cached query results are rebuilt.
+    Called by the bulk write helpers after they commit; callers that commit the
+    update_* helpers themselves should call it after their commit.
+    """
+    global data_version
+    data_version += 1
+
+# One long-lived write connection per thread: a callback thread reuses its connection (and
+# SQLite's warm page cache) instead of opening and closing the database file on every call.
+# Each thread still has its own connection, so writers' transactions stay isolated.
+# Every connection handed out is also tracked by its thread, so close_db_connections() can close
+# them all before the database file is replaced; the generation counter tells threads to reconnect.
+# Threads come and go (e.g. the dev server's thread per request), so whenever a connection is
+# opened, those of threads that have exited are closed and dropped: the pool never holds more
+# connections than there are live threads.
+_thread_local = threading.local()
+_db_connections = {} # threading.Thread -> its connection
+_db_connections_lock = threading.Lock()
+_db_generation = 0
+
+# Natural order of sample IDs (s1, s2, ..., s10): the non-digit prefix, then the trailing number
+# as an integer. An ID that isn't prefix + digits sorts by the whole ID with number -1. The app
+# sorts the display table by the same key in pandas (app._natural_sort_samples), and SQL gets it
+# as the sample_prefix()/sample_number() functions registered on every connection.
+SAMPLE_ID_PATTERN = re.compile(r'^(\D*)(\d*)$')
+
+def _sample_prefix(sample_id):
+    """The natural sort prefix of a sample ID (see SAMPLE_ID_PATTERN)."""
+    match = SAMPLE_ID_PATTERN.match(str(sample_id))
+    return match.group(1) if match else str(sample_id)
+
+def _sample_number(sample_id):
+    """The natural sort number of a sample ID, or -1 if it has none (see SAMPLE_ID_PATTERN)."""
+    match = SAMPLE_ID_PATTERN.match(str(sample_id))
+    return int(match.group(2)) if match and match.group(2) else -1
+
+def _configure_connection(conn):
+    """Applies the journaling, durability and cache settings shared by every connection."""
+    conn.create_function('sample_prefix', 1, _sample_prefix, deterministic=True)
+    conn.create_function('sample_number', 1, _sample_number, deterministic=True)
+    if db_name != ':memory:': # An in-memory database has no file to write a WAL next to
+        conn.execute("PRAGMA journal_mode = WAL") # Persistent: stored in the database file
+    # With WAL, NORMAL only syncs at checkpoints rather than on every commit
+    conn.execute("PRAGMA synchronous = NORMAL")
+    # Keep the temporary b-trees of sorts and window functions in memory
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA cache_size = -65536") # 64 MiB page cache (negative = KiB)
+    conn.execute("PRAGMA mmap_size = 268435456") # Memory-map up to 256 MiB of the file
+    # Wait up to 5 s for another connection's write lock instead of failing with 'database is locked'
+    conn.execute("PRAGMA busy_timeout = 5000")
 
 def get_db_connection():
-    """Establishes and returns a connection to the SQLite database."""
-    conn = sqlite3.connect(db_name)
-    conn.row_factory = sqlite3.Row # Allows accessing columns by name
+    """
+    Returns this thread's connection to the SQLite database, opening it on first use.
+    The connection is reused across calls, so callers must not close it; they commit or
+    roll back their own transactions. A transaction still open at checkout (a failed caller
+    that neither committed nor rolled back, or a helper called inside a caller's transaction)
+    is a caller bug: it is reported and rolled back, so its write lock is not held forever.
+    """
+    conn = getattr(_thread_local, 'conn', None)
+    if conn is None or _thread_local.generation != _db_generation:
+        # check_same_thread=False so the connection may be used off its own thread, which only
+        # happens in two places: close_db_connections() and the dead-thread pruning below close
+        # it from another thread, and app.upload_data lends it to one insert worker thread. In
+        # each case a single thread uses it at a time (the owner waits for the worker first).
+        conn = sqlite3.connect(db_name, check_same_thread=False)
+        conn.row_factory = sqlite3.Row # Allows accessing columns by name
+        _configure_connection(conn)
+        with _db_connections_lock:
+            for thread in [t for t in _db_connections if not t.is_alive()]:
+                _db_connections.pop(thread).close()
+            _db_connections[threading.current_thread()] = conn
+            _thread_local.conn = conn
+            _thread_local.generation = _db_generation
+    elif conn.in_transaction:
+        print(f"Warning: connection to '{db_name}' handed out with a transaction still open; "
+              "rolling back its uncommitted changes.")
+        conn.rollback()
     return conn
 
-def init_database():
-    # remove database if it already exists in folder
-    if os.path.exists(db_name):
-        os.remove(db_name)
-        print(f"Existing database '{db_name}' removed.")
-
-    """Initializes the SQLite database with the defined schema."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    # Create projects table
+def close_db_connections():
+    """Closes every thread's write connection and the shared read connection (e.g. before the database file is replaced)."""
+    global _db_generation
+    with _db_connections_lock:
+        for conn in _db_connections.values():
+            conn.close()
+        _db_connections.clear()
+        _db_generation += 1
+    close_read_connection()
+
+# Long-lived connection shared by the read-only queries behind the Dash callbacks, so a
+# callback doesn't pay for opening the database file and re-warming SQLite's page cache.
+# Writers keep using get_db_connection() so their transactions stay isolated.
+_read_conn = None
+_read_lock = threading.Lock()
+
+def get_read_connection():
+    """
+    Returns the shared read connection, opening it on first use.
+    The database is switched to WAL journaling here, so these reads don't block writers
+    (and vice versa). Hold read_lock() while using it; never close it directly.
+    """
+    global _read_conn
+    if _read_conn is None:
+        _read_conn = sqlite3.connect(db_name, check_same_thread=False)
+        _configure_connection(_read_conn)
+        create_views_and_indexes(_read_conn.cursor())
+        _read_conn.commit()
+    return _read_conn
+
+def read_lock():
+    """Lock serializing use of the shared read connection across callback threads."""
+    return _read_lock
+
+def close_read_connection():
+    """Closes the shared read connection (e.g. before the database file is replaced)."""
+    global _read_conn
+    with _read_lock:
+        if _read_conn is not None:
+            _read_conn.close()
+            _read_conn = None
+
+def create_views_and_indexes(cursor):
+    """
+    Creates the secondary indexes and the v_sample_percentage and v_rel_freq views (idempotent).
+    Run by init_database, and when the shared read connection opens so that databases
+    built before these objects existed get them too.
+    """
+    # Covering index for the per-sample reads: the join on sample_id, the window-function
+    # partition and the pivot only need (sample_id, population, count) plus the rowid (id),
+    # so SQLite can answer them from the index without touching the table
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS projects (
-            project_id TEXT PRIMARY KEY
-        )
+        CREATE INDEX IF NOT EXISTS idx_cell_counts_sample_population_count
+        ON cell_counts (sample_id, population, count)
     ''')
-
-    # Create subjects table
+    # Foreign-key columns used by the samples -> subjects -> projects joins
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_samples_subject ON samples (subject_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_subjects_project ON subjects (project_id)")
+    # The baseline queries filter samples on these four columns; with the index they are a
+    # range lookup instead of a scan of samples
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS subjects (
-            subject_id TEXT PRIMARY KEY,
-            project_id TEXT NOT NULL,
-            age INTEGER,
-            sex TEXT,
-            FOREIGN KEY (project_id) REFERENCES projects(project_id) ON DELETE CASCADE
-        )
+        CREATE INDEX IF NOT EXISTS idx_samples_baseline
+        ON samples (condition, treatment, sample_type, time_from_treatment_start)
     ''')
 
-    # Create samples table
+    # One row per (sample, population) with all metadata, the per-sample total and the percentage.
+    # The long-format queries all select from this view instead of repeating the join and
+    # window functions; row_id (the cell_counts id) keeps the insertion order for ties.
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS samples (
-            sample_id TEXT PRIMARY KEY,
-            subject_id TEXT NOT NULL,
-            condition TEXT,
-            treatment TEXT,
-            response TEXT,
-            sample_type TEXT,
-            time_from_treatment_start INTEGER,
-            FOREIGN KEY (subject_id) REFERENCES subjects(subject_id) ON DELETE CASCADE
-        )
+        CREATE VIEW IF NOT EXISTS v_sample_percentage AS
+        SELECT
+            samp.sample_id AS sample,
+            SUM(cc.count) OVER (PARTITION BY cc.sample_id) AS total_count,
+            cc.population,
+            cc.count,
+            100.0 * cc.count / SUM(cc.count) OVER (PARTITION BY cc.sample_id) AS percentage,
+            s.project_id AS project,
+            s.subject_id AS subject,
+            samp.condition,
+            s.age,
+            s.sex,
+            samp.treatment,
+            samp.response,
+            samp.sample_type,
+            samp.time_from_treatment_start,
+            cc.id AS row_id
+        FROM samples samp
+        JOIN subjects s ON samp.subject_id = s.subject_id
+        JOIN cell_counts cc ON samp.sample_id = cc.sample_id
     ''')
 
-    # Create cell_counts table
+    # Relative frequencies from cell_counts alone: each count joined to its sample's total
+    # (one grouped pass over the covering index). cell_counts.sample_id already holds the
+    # sample label, so callers that don't need the metadata skip the samples/subjects joins.
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS cell_counts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            sample_id TEXT NOT NULL,
-            population TEXT NOT NULL,
-            count INTEGER NOT NULL,
-            FOREIGN KEY (sample_id) REFERENCES samples(sample_id) ON DELETE CASCADE,
-            UNIQUE (sample_id, population) -- Ensure one entry per population per sample
-        )
+        CREATE VIEW IF NOT EXISTS v_rel_freq AS
+        SELECT
+            cc.sample_id AS sample,
+            t.total_count,
+            cc.population,
+            cc.count,
+            100.0 * cc.count / t.total_count AS percentage,
+            cc.id AS row_id
+        FROM cell_counts cc
+        JOIN (SELECT sample_id, SUM(count) AS total_count FROM cell_counts GROUP BY sample_id) t
+            ON cc.sample_id = t.sample_id
     ''')
 
+# Version of the schema and of the CSV load rules, stored in the database file as
+# PRAGMA user_version by init_database. Bump it whenever either changes, so startup knows that
+# a database written by an older version must be rebuilt (see app.prepare_database).
+SCHEMA_VERSION = 1
+
+# Table definitions, run as one script by init_database
+SCHEMA_SQL = """
+    CREATE TABLE IF NOT EXISTS projects (
+        project_id TEXT PRIMARY KEY
+    );
+
+    CREATE TABLE IF NOT EXISTS subjects (
+        subject_id TEXT PRIMARY KEY,
+        project_id TEXT NOT NULL,
+        age INTEGER,
+        sex TEXT,
+        FOREIGN KEY (project_id) REFERENCES projects(project_id) ON DELETE CASCADE
+    );
+
+    -- WITHOUT ROWID: rows are stored in the sample_id primary-key b-tree itself, instead of a
+    -- rowid table plus a separate index on the text key (samples are only looked up by ID)
+    CREATE TABLE IF NOT EXISTS samples (
+        sample_id TEXT PRIMARY KEY,
+        subject_id TEXT NOT NULL,
+        condition TEXT,
+        treatment TEXT,
+        response TEXT,
+        sample_type TEXT,
+        time_from_treatment_start INTEGER,
+        FOREIGN KEY (subject_id) REFERENCES subjects(subject_id) ON DELETE CASCADE
+    ) WITHOUT ROWID;
+
+    -- cell_counts keeps its rowid: the AUTOINCREMENT id records insertion order, which the
+    -- views expose as row_id to order a sample's populations as they were added
+    CREATE TABLE IF NOT EXISTS cell_counts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        sample_id TEXT NOT NULL,
+        population TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        FOREIGN KEY (sample_id) REFERENCES samples(sample_id) ON DELETE CASCADE,
+        UNIQUE (sample_id, population) -- Ensure one entry per population per sample
+    );
+"""
+
+def init_database():
+    # Open connections would keep pointing at the removed file
+    close_db_connections()
+
+    # remove database if it already exists in folder
+    if os.path.exists(db_name):
+        os.remove(db_name)
+        print(f"Existing database '{db_name}' removed.")
+    # Stale WAL/shared-memory files from a previous database must not be replayed into the new one
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(db_name + suffix):
+            os.remove(db_name + suffix)
+
+    """Initializes the SQLite database with the defined schema."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+
+    # One script for all the tables (see SCHEMA_SQL)
+    conn.executescript(SCHEMA_SQL)
+    create_views_and_indexes(cursor)
+    cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
     conn.commit()
-    conn.close()
+    bump_data_version()
     print(f"Database '{db_name}' initialized successfully.")
 
+# Statement texts for the add path, kept as module constants so every call passes the
+# identical string and sqlite3's per-connection statement cache can reuse the compiled plan
+INSERT_PROJECT_SQL = "INSERT OR IGNORE INTO projects (project_id) VALUES (?)"
+INSERT_SUBJECT_SQL = "INSERT OR IGNORE INTO subjects (subject_id, project_id, age, sex) VALUES (?, ?, ?, ?)"
+INSERT_SAMPLE_SQL = """
+    INSERT OR REPLACE INTO samples
+    (sample_id, subject_id, condition, treatment, response, sample_type, time_from_treatment_start)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+INSERT_CELL_SQL = """
+    INSERT OR REPLACE INTO cell_counts
+    (sample_id, population, count)
+    VALUES (?, ?, ?)
+"""
+
+# Cell population columns of the wide (one row per sample) data, in storage order
+CELL_COUNT_COLUMNS = ['b_cell', 'cd8_t_cell', 'cd4_t_cell', 'nk_cell', 'monocyte']
+
+def _normalize_data_columns(df: pd.DataFrame):
+    """Coerces the integer columns and normalizes 'response' in place, before the rows are written."""
+    # Handle potential None/NaN values for integer columns before building the parameter lists
+    for col in ['age', 'time_from_treatment_start'] + CELL_COUNT_COLUMNS:
+        # Integer columns without missing values (e.g. already coerced by the upload validation)
+        # need no NaN filling, so only other columns pay for a second to_numeric pass
+        # (a nullable Int64 column can still hold NA, hence the hasnans check)
+        if col in df.columns and not (pd.api.types.is_integer_dtype(df[col]) and not df[col].hasnans):
+            # Ensure numeric conversion and fill NaNs with 0, then convert to int
+            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(int)
+
+    # Ensure 'response' column handles None properly (if it's not a mandatory field)
+    if 'response' in df.columns:
+        df['response'] = df['response'].astype(str).replace({'None': None, 'nan': None, '': None})
+
 # New: Generic bulk add function to replace load_data_from_csv and add_sample
-def bulk_add_data(conn, df: pd.DataFrame):
+def bulk_add_data(conn, df: pd.DataFrame, commit=True):
     """
     Adds/updates data from a DataFrame into the database.
     Handles inserting projects, subjects, samples, and cell counts.
     Uses INSERT OR IGNORE for projects and subjects to avoid duplicates.
     Uses INSERT OR REPLACE for samples and cell_counts to handle updates to existing
     samples or new sample additions with existing IDs.
+    All rows are written and then committed together, so an error leaves none of them in the
+    database. With commit=False nothing is committed, so the caller can make this part of a
+    larger transaction (an error still rolls back the open transaction before re-raising).
     """
     cursor = conn.cursor()
 
     # List of cell population columns
-    cell_cols = ['b_cell', 'cd8_t_cell', 'cd4_t_cell', 'nk_cell', 'monocyte']
-
-    # Handle potential None/NaN values for integer columns before iterrows
-    for col in ['age', 'time_from_treatment_start'] + cell_cols:
-        if col in df.columns:
-            # Ensure numeric conversion and fill NaNs with 0, then convert to int
-            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(int) 
-
-    # Ensure 'response' column handles None properly (if it's not a mandatory field)
-    if 'response' in df.columns:
-        df['response'] = df['response'].astype(str).replace({'None': None, 'nan': None, '': None})
+    cell_cols = CELL_COUNT_COLUMNS
+
+    _normalize_data_columns(df)
+
+    # One parameter list per table, built from whole columns (tolist() gives plain Python values
+    # sqlite3 can bind), so each table is written by a single executemany, whose loop runs in C,
+    # instead of a Python-level execute per row
+    def column_values(col):
+        return df[col].tolist()
+
+    sample_ids = column_values('sample')
+    # Projects are deduplicated keeping first-seen order; the other tables get every row, in row
+    # order, so INSERT OR IGNORE/REPLACE keep the same (first/last) row as a per-row loop would
+    project_rows = [(project_id,) for project_id in dict.fromkeys(column_values('project'))]
+    subject_rows = list(zip(column_values('subject'), column_values('project'),
+                            column_values('age'), column_values('sex')))
+    sample_rows = list(zip(sample_ids, column_values('subject'), column_values('condition'),
+                           column_values('treatment'), column_values('response'),
+                           column_values('sample_type'), column_values('time_from_treatment_start')))
+    # Cell counts row-major (each sample's five populations together), so the new ids are
+    # assigned in the same order as before. The count columns were coerced to int above, so they
+    # come out as one int64 matrix whose tolist() yields plain ints with no per-cell NaN check
+    count_matrix = df[cell_cols].to_numpy(dtype='int64').tolist()
+    cell_rows = [
+        (sample_id, col, count)
+        for sample_id, counts in zip(sample_ids, count_matrix)
+        for col, count in zip(cell_cols, counts)
+    ]
 
-
-    for index, row in df.iterrows():
-        try:
-            # Insert into projects (INSERT OR IGNORE to handle duplicates)
-            cursor.execute("INSERT OR IGNORE INTO projects (project_id) VALUES (?)", (row['project'],))
-
-            # Insert into subjects (INSERT OR IGNORE to handle duplicates)
-            # Ensure project_id is correctly mapped from 'project' column
-            cursor.execute("INSERT OR IGNORE INTO subjects (subject_id, project_id, age, sex) VALUES (?, ?, ?, ?)",
-                           (row['subject'], row['project'], row['age'], row['sex']))
-
-            # Insert into samples (INSERT OR REPLACE to update if sample_id exists)
-            # This handles both new sample insertion and updates if sample_id is provided in the new data
-            cursor.execute("""
-                INSERT OR REPLACE INTO samples
-                (sample_id, subject_id, condition, treatment, response, sample_type, time_from_treatment_start)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (row['sample'], row['subject'], row['condition'], row['treatment'],
-                  row['response'], row['sample_type'], row['time_from_treatment_start']))
-
-            # Insert into cell_counts for each cell population (INSERT OR REPLACE)
-            # This handles both new cell counts and updates to existing ones for a given sample_id and population
-            for col in cell_cols:
-                # Ensure count is not None or NaN before insertion
-                count_val = row[col] if pd.notna(row[col]) else 0
-                cursor.execute("""
-                    INSERT OR REPLACE INTO cell_counts
-                    (sample_id, population, count)
-                    VALUES (?, ?, ?)
-                """, (row['sample'], col, count_val))
-            conn.commit() # Commit each row to make transaction smaller or commit at the end of the loop if preferred for performance
-        except sqlite3.IntegrityError as e:
-            # This will catch issues like non-existent project_id or subject_id if not handled by INSERT OR IGNORE
-            print(f"Integrity Error for row {row.get('sample', 'N/A')}: {e}")
-            conn.rollback() # Rollback the current transaction for this row
-            raise # Re-raise to let the app callback handle the error
-        except Exception as e:
-            print(f"Error processing row {row.get('sample', 'N/A')}: {e}")
-            conn.rollback()
-            raise
+    try:
+        if commit and not conn.in_transaction:
+            # One explicit transaction for the whole call (a single commit/fsync), taking the write
+            # lock up front instead of upgrading a deferred transaction at the first INSERT
+            cursor.execute("BEGIN IMMEDIATE")
+        # Insert into projects (INSERT OR IGNORE to handle duplicates)
+        cursor.executemany(INSERT_PROJECT_SQL, project_rows)
+        # Insert into subjects (INSERT OR IGNORE to handle duplicates)
+        # Ensure project_id is correctly mapped from 'project' column
+        cursor.executemany(INSERT_SUBJECT_SQL, subject_rows)
+        # Insert into samples (INSERT OR REPLACE to update if sample_id exists)
+        # This handles both new sample insertion and updates if sample_id is provided in the new data
+        cursor.executemany(INSERT_SAMPLE_SQL, sample_rows)
+        # Insert into cell_counts for each cell population (INSERT OR REPLACE)
+        # This handles both new cell counts and updates to existing ones for a given sample_id and population
+        cursor.executemany(INSERT_CELL_SQL, cell_rows)
+        if commit:
+            conn.commit()
+    except sqlite3.IntegrityError as e:
+        # This will catch issues like missing required IDs (NOT NULL) in any of the rows.
+        # executemany doesn't say which row failed, so name the rows missing one of the IDs
+        missing_ids = df[['project', 'subject', 'sample']].isna().any(axis=1)
+        print(f"Integrity Error adding {len(sample_ids)} rows: {e} "
+              f"(rows missing a project/subject/sample ID: {df.index[missing_ids].tolist()})")
+        conn.rollback() # Nothing from this call is kept
+        raise # Re-raise to let the app callback handle the error
+    except Exception as e:
+        print(f"Error adding {len(sample_ids)} rows: {e}")
+        conn.rollback()
+        raise
+    finally:
+        bump_data_version()
 
 
 # New: Bulk delete function
-def bulk_delete_samples(conn, sample_ids: list):
+def bulk_delete_samples(conn, sample_ids: list, commit=True):
     """
     Removes multiple samples and their associated cell counts from the database.
     Returns the number of samples successfully deleted.
+    With commit=False the deletes are left uncommitted, for the caller's transaction.
     """
     cursor = conn.cursor()
-    deleted_count = 0
+    id_rows = [(sample_id,) for sample_id in sample_ids]
     try:
-        for sample_id in sample_ids:
-            # Delete cell counts first due to foreign key constraint
-            cursor.execute("DELETE FROM cell_counts WHERE sample_id = ?", (sample_id,))
-            # Then delete the sample itself
-            cursor.execute("DELETE FROM samples WHERE sample_id = ?", (sample_id,))
-            if cursor.rowcount > 0:
-                deleted_count += 1
-        conn.commit()
+        # One executemany per table instead of two execute calls per ID.
+        # The cell counts are deleted explicitly rather than through ON DELETE CASCADE: enabling
+        # foreign_keys would also make the INSERT OR REPLACE in bulk_add_data cascade-delete the
+        # replaced sample's cell counts.
+        # Delete cell counts first due to foreign key constraint
+        cursor.executemany("DELETE FROM cell_counts WHERE sample_id = ?", id_rows)
+        # Then delete the samples themselves; rowcount is the total over all IDs (a repeated ID
+        # matches nothing the second time, so each deleted sample is counted once)
+        cursor.executemany("DELETE FROM samples WHERE sample_id = ?", id_rows)
+        deleted_count = max(cursor.rowcount, 0)
+        if commit:
+            conn.commit()
         return deleted_count
     except sqlite3.Error as e:
         print(f"Error removing samples: {e}")
         conn.rollback()
         raise # Re-raise to let the app callback handle the error
+    finally:
+        bump_data_version()
 
 
 # New: Helper to get subject_id from sample_id
@@ -168,6 +420,30 @@ def get_subject_id_from_sample_id(conn, sample_id):
 
 
 # New: Update functions for in-table editing
+# Each table has one static UPDATE covering all of its editable columns, so every call runs the
+# identical SQL text (compiled once, then reused from sqlite3's statement cache) instead of an
+# f-string built from the keys present. Each column takes a (flag, value) parameter pair and is
+# only assigned when the flag is set, so fields missing from an update keep their value while
+# an explicit None still sets NULL.
+SUBJECT_UPDATE_COLUMNS = ('project_id', 'age', 'sex')
+SAMPLE_UPDATE_COLUMNS = ('condition', 'treatment', 'response', 'sample_type', 'time_from_treatment_start')
+
+def _flagged_update_sql(table, columns, where):
+    """UPDATE statement assigning each column only when its flag parameter is true."""
+    assignments = ', '.join(f"{col} = CASE WHEN ? THEN ? ELSE {col} END" for col in columns)
+    return f"UPDATE {table} SET {assignments} WHERE {where}"
+
+UPDATE_SUBJECT_SQL = _flagged_update_sql('subjects', SUBJECT_UPDATE_COLUMNS, 'subject_id = ?')
+UPDATE_SAMPLE_SQL = _flagged_update_sql('samples', SAMPLE_UPDATE_COLUMNS, 'sample_id = ?')
+
+def _flagged_update_params(columns, updates, key):
+    """Parameters for a _flagged_update_sql statement: (present, value) per column, then the key."""
+    params = []
+    for col in columns:
+        params += (col in updates, updates.get(col))
+    params.append(key)
+    return params
+
 def update_subject_fields(conn, subject_id, updates_dict):
     """
     Updates fields in the subjects table for a given subject_id.
@@ -175,87 +451,377 @@ def update_subject_fields(conn, subject_id, updates_dict):
     """
     if not updates_dict:
         return
-    
-    set_clauses = []
-    values = []
-    
-    # Process project_id separately as its column name in DB is 'project_id', not 'project'
+
+    # Fields relevant to the subjects table; 'project' is stored as 'project_id'
+    updates = {k: v for k, v in updates_dict.items() if k in ('age', 'sex')}
     if 'project' in updates_dict:
-        new_project_id = updates_dict['project']
-        set_clauses.append("project_id = ?")
-        values.append(new_project_id)
+        updates['project_id'] = updates_dict['project']
         # Ensure the new project_id exists in the projects table
-        cursor = conn.cursor()
-        cursor.execute("INSERT OR IGNORE INTO projects (project_id) VALUES (?)", (new_project_id,))
-
-    # Process other fields relevant to the subjects table
-    subject_table_cols = ['age', 'sex'] # These map directly
-    for k, v in updates_dict.items():
-        if k in subject_table_cols:
-            set_clauses.append(f"{k} = ?")
-            values.append(v)
-    
-    if not set_clauses: # No valid updates for this table
-        return
+        conn.execute(INSERT_PROJECT_SQL, (updates_dict['project'],))
 
-    values.append(subject_id) # Add subject_id for the WHERE clause
+    if not updates: # No valid updates for this table
+        return
 
-    query = f"UPDATE subjects SET {', '.join(set_clauses)} WHERE subject_id = ?"
-    cursor = conn.cursor()
-    cursor.execute(query, values)
+    conn.execute(UPDATE_SUBJECT_SQL, _flagged_update_params(SUBJECT_UPDATE_COLUMNS, updates, subject_id))
     # No commit here, will commit in the calling app callback after all updates for a sample are done
 
 def update_sample_fields(conn, sample_id, updates_dict):
     """Updates fields in the samples table for a given sample_id."""
     if not updates_dict:
         return
-    
-    # Filter for fields relevant to the samples table
-    sample_table_cols = ['condition', 'treatment', 'response', 'sample_type', 'time_from_treatment_start']
-    valid_updates = {k: v for k, v in updates_dict.items() if k in sample_table_cols}
 
+    # Filter for fields relevant to the samples table
+    valid_updates = {k: v for k, v in updates_dict.items() if k in SAMPLE_UPDATE_COLUMNS}
     if not valid_updates:
         return
 
-    set_clauses = [f"{k} = ?" for k in valid_updates.keys()]
-    values = list(valid_updates.values())
-    values.append(sample_id) # Add sample_id for the WHERE clause
-
-    query = f"UPDATE samples SET {', '.join(set_clauses)} WHERE sample_id = ?"
-    cursor = conn.cursor()
-    cursor.execute(query, values)
+    conn.execute(UPDATE_SAMPLE_SQL, _flagged_update_params(SAMPLE_UPDATE_COLUMNS, valid_updates, sample_id))
     # No commit here
 
+# Cell count write for user edits: the value is bound as typed and converted by SQLite. Going
+# through REAL first accepts the same inputs int(float(x)) does ('37000', '3.7', '1e3'); text that
+# isn't numeric casts to 0, and COALESCE turns NULL (None or NaN) into 0 as well
+SET_CELL_COUNT_SQL = """
+    INSERT OR REPLACE INTO cell_counts
+    (sample_id, population, count)
+    VALUES (?, ?, COALESCE(CAST(CAST(? AS REAL) AS INTEGER), 0))
+"""
+
 def update_cell_count(conn, sample_id, population_name, new_count):
     """Updates a specific cell population count for a given sample_id."""
-    # Ensure new_count is an integer. Handle non-numeric input gracefully.
-    try:
-        new_count = int(float(new_count)) # Convert to float first to handle string numbers, then to int
-    except (ValueError, TypeError):
-        new_count = 0 # Default to 0 or handle error differently
-
-    query = """
-        INSERT OR REPLACE INTO cell_counts (sample_id, population, count)
-        VALUES (?, ?, ?)
-    """
-    cursor = conn.cursor()
-    cursor.execute(query, (sample_id, population_name, new_count))
+    # new_count may be a user-typed string; SET_CELL_COUNT_SQL converts it to an integer
+    conn.execute(SET_CELL_COUNT_SQL, (sample_id, population_name, new_count))
     # No commit here
 
-
 # The original `load_data_from_csv` is now effectively a wrapper around `bulk_add_data`.
+# Staged CSV load: the whole file goes into a scratch table with DataFrame.to_sql, then each
+# table is filled by one INSERT ... SELECT, so the row fan-out (notably five cell_counts rows per
+# sample) runs inside SQLite instead of building Python parameter tuples. Each statement reads
+# the stage in file order (ORDER BY rowid), so OR IGNORE/OR REPLACE keep the same first/last row
+# as bulk_add_data and the cell counts get their ids in the same row-major order.
+CSV_STAGE_TABLE = 'csv_stage'
+_STAGE_POPULATIONS_CTE = "populations (ord, population) AS (VALUES " + ", ".join(
+    f"({i}, '{col}')" for i, col in enumerate(CELL_COUNT_COLUMNS)) + ")"
+STAGED_INSERT_SQL = (
+    f"""
+    INSERT OR IGNORE INTO projects (project_id)
+    SELECT project FROM {CSV_STAGE_TABLE} ORDER BY rowid
+    """,
+    f"""
+    INSERT OR IGNORE INTO subjects (subject_id, project_id, age, sex)
+    SELECT subject, project, age, sex FROM {CSV_STAGE_TABLE} ORDER BY rowid
+    """,
+    f"""
+    INSERT OR REPLACE INTO samples
+    (sample_id, subject_id, condition, treatment, response, sample_type, time_from_treatment_start)
+    SELECT sample, subject, condition, treatment, response, sample_type, time_from_treatment_start
+    FROM {CSV_STAGE_TABLE} ORDER BY rowid
+    """,
+    f"""
+    WITH {_STAGE_POPULATIONS_CTE}
+    INSERT OR REPLACE INTO cell_counts (sample_id, population, count)
+    SELECT stage.sample, p.population,
+           CASE p.population {' '.join(f"WHEN '{col}' THEN stage.{col}" for col in CELL_COUNT_COLUMNS)} END
+    FROM {CSV_STAGE_TABLE} AS stage CROSS JOIN populations AS p
+    ORDER BY stage.rowid, p.ord
+    """,
+)
+
+# Column dtypes for reading the CSV: the text columns stay text even in a chunk where one is
+# entirely empty (and numeric-looking IDs aren't turned into numbers). The count, age and time
+# columns are left to the parser's inference and then coerced by _normalize_data_columns, as
+# before: non-numeric or missing values become 0 and fractional ones are truncated, instead of
+# a strict integer dtype failing the whole load on one cell.
+CSV_COLUMN_DTYPES = {col: 'str' for col in ['project', 'subject', 'sex', 'sample', 'condition',
+                                            'treatment', 'response', 'sample_type']}
+CSV_CHUNK_ROWS = 10_000
+
+def _load_csv_staged(conn, chunks):
+    """Writes CSV DataFrame chunks through the staging table (see STAGED_INSERT_SQL)."""
+    columns = ['project', 'subject', 'age', 'sex', 'sample', 'condition', 'treatment', 'response',
+               'sample_type', 'time_from_treatment_start'] + CELL_COUNT_COLUMNS
+    cursor = conn.cursor()
+    try:
+        # Each chunk is appended to the stage as it is read, so only one chunk is held in memory.
+        # method='multi' sends each 500 rows as one multi-row INSERT; 500 rows x 15 columns stays
+        # below SQLite's bound-parameter limit
+        if_exists = 'replace'
+        for chunk in chunks:
+            _normalize_data_columns(chunk)
+            chunk[columns].to_sql(CSV_STAGE_TABLE, conn, if_exists=if_exists, index=False,
+                                  method='multi', chunksize=500)
+            if_exists = 'append'
+        # The real tables are only written here, all in one transaction
+        cursor.execute("BEGIN IMMEDIATE")
+        for sql in STAGED_INSERT_SQL:
+            cursor.execute(sql)
+        cursor.execute(f"DROP TABLE {CSV_STAGE_TABLE}")
+        conn.commit()
+    except Exception:
+        # A read/parse error, or a failed stage or final write: keep none of the real tables' rows
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    finally:
+        # Never leave a partial stage behind (a no-op after a successful load)
+        conn.execute(f"DROP TABLE IF EXISTS {CSV_STAGE_TABLE}")
+        conn.commit()
+        bump_data_version()
+
 def load_data_from_csv(csv_filepath):
-    """Initializes DB and loads data from a CSV file into the database."""
+    """Initializes DB and loads data from a CSV file into the database; re-raises any load error."""
     init_database() # Ensure database is initialized and clear
     conn = get_db_connection()
     try:
-        df = pd.read_csv(csv_filepath)
-        bulk_add_data(conn, df) # Use the new bulk_add_data function
+        chunks = pd.read_csv(csv_filepath, chunksize=CSV_CHUNK_ROWS, dtype=CSV_COLUMN_DTYPES)
+        _load_csv_staged(conn, chunks)
         print(f"Data from '{csv_filepath}' loaded successfully into '{db_name}'.")
     except Exception as e:
         print(f"Error loading data from CSV: {e}")
-    finally:
-        conn.close()
+        raise # The caller (e.g. app.prepare_database) must not carry on with an empty database
+
+
+# New: Relative frequencies computed inside SQLite
+def fetch_relative_frequency():
+    """
+    Fetches the long-format relative frequency table (one row per sample and population).
+    total_count and percentage are computed by SQLite window functions in a single pass
+    over the join, so no pandas groupby/merge is needed afterwards.
+    Columns match the output of analysis.get_relative_frequency.
+    """
+    query = """
+    SELECT
+        sample, total_count, population, count, percentage, project, subject, condition,
+        age, sex, treatment, response, sample_type, time_from_treatment_start
+    FROM v_sample_percentage
+    ORDER BY
+        SUBSTR(sample, 1, 1) ASC,
+        CAST(SUBSTR(sample, 2) AS INTEGER) ASC,
+        row_id ASC
+    """
+    categorical_cols = ['condition', 'treatment', 'sample_type', 'response', 'population', 'project', 'sex']
+    chunks = []
+    with read_lock():
+        conn = get_read_connection()
+        # Stream the result in chunks and compact each one as it arrives, so the full
+        # list of row tuples and the object-dtype frame never exist at the same time
+        for chunk in pd.read_sql_query(query, conn, chunksize=read_chunk_size):
+            # Sample metadata repeats once per population in the long format; store the
+            # low-cardinality strings as categoricals instead of one Python object per row
+            for col in categorical_cols:
+                chunk[col] = chunk[col].astype('category')
+            # float32 is enough precision for a displayed percentage and the rank-based tests
+            chunk['percentage'] = chunk['percentage'].astype('float32')
+            chunks.append(chunk)
+
+    if len(chunks) == 1:
+        return chunks[0]
+    if not chunks:
+        return pd.DataFrame(columns=[
+            'sample', 'total_count', 'population', 'count', 'percentage', 'project', 'subject',
+            'condition', 'age', 'sex', 'treatment', 'response', 'sample_type', 'time_from_treatment_start'
+        ])
+    # Chunks carry their own category sets; unify them so the concatenated columns stay categorical
+    for col in categorical_cols:
+        categories = sorted(set().union(*(chunk[col].cat.categories for chunk in chunks)))
+        for chunk in chunks:
+            chunk[col] = chunk[col].cat.set_categories(categories)
+    return pd.concat(chunks, ignore_index=True)
+
+
+# New: One page of the relative frequency table, for server-side paging in the Dash table
+rel_freq_page_columns = ['sample', 'total_count', 'population', 'count', 'percentage']
+
+# The page only shows per-sample counts and percentages, so it reads the join-free v_rel_freq
+# view rather than v_sample_percentage with its samples/subjects joins
+_rel_freq_page_source = """
+    SELECT
+        sample, total_count, population, count, percentage,
+        SUBSTR(sample, 1, 1) AS sample_prefix,
+        CAST(SUBSTR(sample, 2) AS INTEGER) AS sample_number,
+        row_id
+    FROM v_rel_freq
+"""
+
+_rel_freq_filter_operators = {'=', '!=', '<', '<=', '>', '>=', 'contains', 'startswith'}
+
+def fetch_rel_freq_page(offset, limit, sort_by=None, filters=None):
+    """
+    Fetches one page of the long-format relative frequency table
+    (sample, total_count, population, count, percentage) with LIMIT/OFFSET,
+    so only page-sized results leave SQLite.
+
+    Args:
+        offset (int): Number of rows to skip.
+        limit (int): Maximum number of rows to return.
+        sort_by (list): (column, ascending) pairs, applied before the natural sample order.
+        filters (list): (column, operator, value) triples combined with AND. Operators are
+                        =, !=, <, <=, >, >=, contains and startswith.
+
+    Returns:
+        tuple: (page DataFrame, total number of rows matching the filters)
+    """
+    where_clauses = []
+    params = []
+    for column, operator, value in filters or []:
+        # Column names and operators are interpolated into the SQL, so only known ones are accepted
+        if column not in rel_freq_page_columns or operator not in _rel_freq_filter_operators:
+            raise ValueError(f"Unsupported filter: {column} {operator}")
+        if operator == 'contains':
+            where_clauses.append(f"CAST({column} AS TEXT) LIKE ?")
+            params.append(f"%{value}%")
+        elif operator == 'startswith':
+            where_clauses.append(f"CAST({column} AS TEXT) LIKE ?")
+            params.append(f"{value}%")
+        else:
+            where_clauses.append(f"{column} {operator} ?")
+            params.append(value)
+    where_sql = f"WHERE {' AND '.join(where_clauses)}" if where_clauses else ""
+
+    order_terms = []
+    for column, ascending in sort_by or []:
+        if column not in rel_freq_page_columns:
+            raise ValueError(f"Unsupported sort column: {column}")
+        order_terms.append(f"{column} {'ASC' if ascending else 'DESC'}")
+    # Ties (and the unsorted table) fall back to the natural sample order used everywhere else
+    order_terms += ['sample_prefix ASC', 'sample_number ASC', 'row_id ASC']
+
+    page_query = f"""
+    SELECT {', '.join(rel_freq_page_columns)}
+    FROM ({_rel_freq_page_source})
+    {where_sql}
+    ORDER BY {', '.join(order_terms)}
+    LIMIT ? OFFSET ?
+    """
+    count_query = f"SELECT COUNT(*) FROM ({_rel_freq_page_source}) {where_sql}"
+
+    with read_lock():
+        conn = get_read_connection()
+        total_rows = conn.execute(count_query, params).fetchone()[0]
+        df = pd.read_sql_query(page_query, conn, params=params + [int(limit), int(offset)])
+    return df, total_rows
+
+
+# New: Baseline melanoma tr1 PBMC breakdown, aggregated by SQLite
+# Baseline samples with their subject's project and sex. subject_row = 1 marks one sample per
+# subject: its first in the natural sample order, whatever its response, like the
+# drop_duplicates(subset=['subject']) over the sorted wide table in
+# analysis.query_baseline_melanoma_tr1_samples.
+_BASELINE_SAMPLES_CTE = """
+    WITH baseline AS (
+        SELECT
+            samp.sample_id,
+            s.project_id AS project,
+            s.sex,
+            samp.response,
+            ROW_NUMBER() OVER (
+                PARTITION BY s.subject_id
+                ORDER BY sample_prefix(samp.sample_id), sample_number(samp.sample_id),
+                         samp.sample_id
+            ) AS subject_row
+        FROM samples samp
+        JOIN subjects s ON samp.subject_id = s.subject_id
+        JOIN projects p ON s.project_id = p.project_id
+        WHERE samp.condition = 'melanoma'
+            AND samp.treatment = 'tr1'
+            AND samp.sample_type = 'PBMC'
+            AND samp.time_from_treatment_start = 0
+    )
+"""
+
+# Each breakdown is a GROUP BY over the CTE; subject counts are ordered most frequent first
+_BASELINE_COUNT_QUERIES = {
+    'samples_per_project': """
+        SELECT project, COUNT(*) AS num_samples FROM baseline
+        GROUP BY project ORDER BY project
+    """,
+    'subject_response_counts': """
+        SELECT response, COUNT(*) AS num_subjects FROM baseline
+        WHERE subject_row = 1 AND response IN ('y', 'n')
+        GROUP BY response ORDER BY num_subjects DESC, response
+    """,
+    'subject_sex_counts': """
+        SELECT sex, COUNT(*) AS num_subjects FROM baseline
+        WHERE subject_row = 1 AND sex IS NOT NULL
+        GROUP BY sex ORDER BY num_subjects DESC, sex
+    """,
+}
+
+def fetch_baseline_melanoma_tr1_counts():
+    """
+    Counts the melanoma PBMC samples at baseline (time_from_treatment_start = 0) from
+    patients with treatment tr1, per project, and their subjects per response and sex.
+    The filtering and grouping run in SQLite, so only the small count tables are returned.
+
+    Returns:
+        tuple: (number of baseline samples, dict of aggregated count DataFrames with the
+               same keys and columns as analysis.query_baseline_melanoma_tr1_samples)
+    """
+    with read_lock():
+        conn = get_read_connection()
+        aggregated_counts = {
+            name: pd.read_sql_query(_BASELINE_SAMPLES_CTE + query, conn)
+            for name, query in _BASELINE_COUNT_QUERIES.items()
+        }
+    # Every baseline sample belongs to exactly one project group
+    num_samples = int(aggregated_counts['samples_per_project']['num_samples'].sum())
+    return num_samples, aggregated_counts
+
+
+# Compact dtypes for the frames the fetch_* helpers return: low-cardinality text columns become
+# categoricals and counts/ages int32 (the stored values are well within its range), instead of
+# read_sql_query's object/int64 defaults. Keyed by the column names the queries produce.
+_SCHEMA_DTYPES = {
+    **dict.fromkeys(['project', 'project_id', 'sex', 'condition', 'treatment', 'response',
+                     'sample_type', 'population'], 'category'),
+    **dict.fromkeys(['age', 'time_from_treatment_start', 'count'] + CELL_COUNT_COLUMNS, 'int32'),
+}
+
+def _apply_schema_dtypes(df):
+    """Casts the columns of df listed in _SCHEMA_DTYPES (integer columns only if they have no NULLs)."""
+    dtypes = {
+        col: dtype for col, dtype in _SCHEMA_DTYPES.items()
+        if col in df.columns and not (dtype == 'int32' and df[col].hasnans)
+    }
+    return df.astype(dtypes)
+
+# New: One row per sample with the cell counts pivoted into columns, aggregated by SQLite
+# The pivot is five conditional SUMs in the GROUP BY, so only one row per sample crosses into
+# pandas (instead of one per sample and population) and no pandas pivot is needed.
+# The other columns come from the sample's single samples/subjects row, so grouping by the
+# sample ID alone is enough.
+FETCH_ALL_DATA_WIDE_SQL = """
+    SELECT
+        p.project_id AS project,
+        s.subject_id AS subject,
+        samp.condition,
+        s.age,
+        s.sex,
+        samp.treatment,
+        samp.response,
+        samp.sample_id AS sample,
+        samp.sample_type,
+        samp.time_from_treatment_start,
+        SUM(CASE WHEN cc.population = 'b_cell' THEN cc.count ELSE 0 END) AS b_cell,
+        SUM(CASE WHEN cc.population = 'cd8_t_cell' THEN cc.count ELSE 0 END) AS cd8_t_cell,
+        SUM(CASE WHEN cc.population = 'cd4_t_cell' THEN cc.count ELSE 0 END) AS cd4_t_cell,
+        SUM(CASE WHEN cc.population = 'nk_cell' THEN cc.count ELSE 0 END) AS nk_cell,
+        SUM(CASE WHEN cc.population = 'monocyte' THEN cc.count ELSE 0 END) AS monocyte
+    FROM projects p
+    JOIN subjects s ON p.project_id = s.project_id
+    JOIN samples samp ON s.subject_id = samp.subject_id
+    LEFT JOIN cell_counts cc ON samp.sample_id = cc.sample_id
+    GROUP BY samp.sample_id
+    ORDER BY samp.sample_id
+"""
+
+def fetch_all_data_wide():
+    """
+    Fetches all samples in wide format: sample and subject details plus one count column per
+    cell population (b_cell, cd8_t_cell, cd4_t_cell, nk_cell, monocyte), ordered by sample_id.
+    """
+    with read_lock():
+        return _apply_schema_dtypes(pd.read_sql_query(FETCH_ALL_DATA_WIDE_SQL, get_read_connection()))
 
 
 # Original functions (kept for reference, might not be directly used by new app.py callbacks)
@@ -286,8 +852,7 @@ def fetch_all_data():
         cell_counts cc ON sam.sample_id = cc.sample_id
     """
     df = pd.read_sql_query(query, conn)
-    conn.close()
-    return df
+    return _apply_schema_dtypes(df)
 
 def fetch_samples_with_subject_info():
     """Fetches sample and subject information for analysis."""
@@ -312,16 +877,14 @@ def fetch_samples_with_subject_info():
         projects p ON s.project_id = p.project_id
     """
     df = pd.read_sql_query(query, conn)
-    conn.close()
-    return df
+    return _apply_schema_dtypes(df)
 
 def fetch_cell_counts():
     """Fetches all cell counts."""
     conn = get_db_connection()
     query = "SELECT sample_id, population, count FROM cell_counts"
     df = pd.read_sql_query(query, conn)
-    conn.close()
-    return df
+    return _apply_schema_dtypes(df)
 
 # Example usage (for testing database.py directly if needed)
 if __name__ == '__main__':
@@ -349,8 +912,6 @@ if __name__ == '__main__':
         print("Dummy data added via bulk_add_data.")
     except Exception as e:
         print(f"Error adding dummy data: {e}")
-    finally:
-        conn.close()
 
     # Example of updating data using the new update functions
     # Using an existing sample from cell-count.csv, e.g., 's1'
@@ -364,13 +925,12 @@ if __name__ == '__main__':
             update_sample_fields(conn, 's1', {'condition': 'melanoma_updated', 'response': 'n'}) # Update sample details
             update_cell_count(conn, 's1', 'b_cell', 37000) # Update a cell count
             conn.commit() # Commit at the end of a series of updates for one logical operation
+            bump_data_version()
             print("Sample 's1' data updated.")
         else:
             print("Sample 's1' not found for update example.")
     except Exception as e:
         print(f"Error updating sample 's1': {e}")
-    finally:
-        conn.close()
 
 
     # Example of deleting data using bulk_delete_samples
@@ -381,12 +941,10 @@ if __name__ == '__main__':
         print(f"Deleted {deleted_count} dummy samples.")
     except Exception as e:
         print(f"Error deleting dummy data: {e}")
-    finally:
-        conn.close()
 
     # Fetch and display all data to verify
     print("\nAll data after operations:")
-    all_data_df_verify = get_all_data_for_display() # Use the app's helper for wide data
+    all_data_df_verify = fetch_all_data_wide() # Wide data, as the app's table shows it
     if not all_data_df_verify.empty:
         print(all_data_df_verify.head().to_markdown(index=False))
     else:
@@ -64,42 +64,15 @@ def main():
 # Helper for CLI to fetch wide data (mimics app.py's get_all_data_for_display)
 def _get_all_data_wide_for_cli():
     """
-    Fetches all data from DB, pivots cell counts to columns, and returns a wide-format DataFrame.
-    This is a copy of the logic in app.py's get_all_data_for_display, for CLI independence.
+    Fetches all data from DB with cell counts pivoted to columns (database.fetch_all_data_wide,
+    pivoted in SQL) and returns a wide-format DataFrame, or an empty one on error.
+    Kept separate from app.py's get_all_data_for_display for CLI independence.
     """
-    conn = database.get_db_connection()
     try:
-        query = """
-        SELECT
-            p.project_id AS project,
-            s.subject_id AS subject,
-            samp.condition,
-            s.age,
-            s.sex,
-            samp.treatment,
-            samp.response,
-            samp.sample_id AS sample,
-            samp.sample_type,
-            samp.time_from_treatment_start,
-            SUM(CASE WHEN cc.population = 'b_cell' THEN cc.count ELSE 0 END) AS b_cell,
-            SUM(CASE WHEN cc.population = 'cd8_t_cell' THEN cc.count ELSE 0 END) AS cd8_t_cell,
-            SUM(CASE WHEN cc.population = 'cd4_t_cell' THEN cc.count ELSE 0 END) AS cd4_t_cell,
-            SUM(CASE WHEN cc.population = 'nk_cell' THEN cc.count ELSE 0 END) AS nk_cell,
-            SUM(CASE WHEN cc.population = 'monocyte' THEN cc.count ELSE 0 END) AS monocyte
-        FROM projects p
-        JOIN subjects s ON p.project_id = s.project_id
-        JOIN samples samp ON s.subject_id = samp.subject_id
-        LEFT JOIN cell_counts cc ON samp.sample_id = cc.sample_id
-        GROUP BY p.project_id, s.subject_id, samp.condition, s.age, s.sex, samp.treatment, samp.response,
-                 samp.sample_id, samp.sample_type, samp.time_from_treatment_start
-        ORDER BY samp.sample_id;
-        """
-        df = pd.read_sql_query(query, conn)
+        df = database.fetch_all_data_wide()
     except Exception as e:
         print(f"CLI Data Fetch Error: {e}")
         return pd.DataFrame()
-    finally:
-        conn.close()
     return df
 
 
@@ -1,60 +1,182 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, ForeignKey, DateTime, Boolean
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
+from typing import List, Optional
+from sqlalchemy import bindparam, create_engine, event, inspect, insert, text, Integer, String, Float, ForeignKey, DateTime, Boolean, Index
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 from datetime import datetime
 
-Base = declarative_base()
+# Typed declarative mappings: the Python type of each attribute is declared with Mapped[...], so
+# its SQL type and result handling are set up once at class definition. Optional[...] marks the
+# columns that may be NULL.
+class Base(DeclarativeBase):
+    pass
+
+# Relationship loading: collections use lazy="selectin" (one WHERE ... IN query per level for all
+# the loaded parents) and the scalar parent sides lazy="joined" (fetched in the same SELECT), so
+# walking project -> subjects -> samples -> cell_counts issues a query per level, not per object
 
 class Project(Base):
     __tablename__ = 'projects'
     
-    project_id = Column(String, primary_key=True)
-    name = Column(String)
-    description = Column(String)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    project_id: Mapped[str] = mapped_column(String, primary_key=True)
+    name: Mapped[Optional[str]] = mapped_column(String)
+    description: Mapped[Optional[str]] = mapped_column(String)
+    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow)
     
-    subjects = relationship("Subject", back_populates="project")
+    subjects: Mapped[List["Subject"]] = relationship(back_populates="project", lazy="selectin")
 
 class Subject(Base):
     __tablename__ = 'subjects'
     
-    subject_id = Column(String, primary_key=True)
-    project_id = Column(String, ForeignKey('projects.project_id'))
-    age = Column(Integer)
-    sex = Column(String)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    subject_id: Mapped[str] = mapped_column(String, primary_key=True)
+    project_id: Mapped[Optional[str]] = mapped_column(String, ForeignKey('projects.project_id'))
+    age: Mapped[Optional[int]] = mapped_column(Integer)
+    sex: Mapped[Optional[str]] = mapped_column(String)
+    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow)
     
-    project = relationship("Project", back_populates="subjects")
-    samples = relationship("Sample", back_populates="subject")
+    project: Mapped[Optional["Project"]] = relationship(back_populates="subjects", lazy="joined")
+    samples: Mapped[List["Sample"]] = relationship(back_populates="subject", lazy="selectin")
 
 class Sample(Base):
     __tablename__ = 'samples'
     
-    sample_id = Column(String, primary_key=True)
-    subject_id = Column(String, ForeignKey('subjects.subject_id'))
-    condition = Column(String)  # e.g., melanoma, bladder_cancer
-    treatment = Column(String)  # e.g., tr1
-    response = Column(String)   # 'y' for responder, 'n' for non-responder
-    sample_type = Column(String)  # e.g., PBMC
-    time_from_treatment_start = Column(Integer)  # in days
-    created_at = Column(DateTime, default=datetime.utcnow)
+    sample_id: Mapped[str] = mapped_column(String, primary_key=True)
+    subject_id: Mapped[Optional[str]] = mapped_column(String, ForeignKey('subjects.subject_id'))
+    condition: Mapped[Optional[str]] = mapped_column(String)  # e.g., melanoma, bladder_cancer
+    treatment: Mapped[Optional[str]] = mapped_column(String)  # e.g., tr1
+    response: Mapped[Optional[str]] = mapped_column(String)   # 'y' for responder, 'n' for non-responder
+    sample_type: Mapped[Optional[str]] = mapped_column(String)  # e.g., PBMC
+    time_from_treatment_start: Mapped[Optional[int]] = mapped_column(Integer)  # in days
+    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow)
     
-    subject = relationship("Subject", back_populates="samples")
-    cell_counts = relationship("CellCount", back_populates="sample")
+    subject: Mapped[Optional["Subject"]] = relationship(back_populates="samples", lazy="joined")
+    cell_counts: Mapped[List["CellCount"]] = relationship(back_populates="sample", lazy="selectin")
 
 class CellCount(Base):
     __tablename__ = 'cell_counts'
     
-    id = Column(Integer, primary_key=True)
-    sample_id = Column(String, ForeignKey('samples.sample_id'))
-    population = Column(String)  # e.g., b_cell, cd8_t_cell
-    count = Column(Integer)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    sample_id: Mapped[Optional[str]] = mapped_column(String, ForeignKey('samples.sample_id'))
+    population: Mapped[Optional[str]] = mapped_column(String)  # e.g., b_cell, cd8_t_cell
+    count: Mapped[Optional[int]] = mapped_column(Integer)
+    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow)
     
-    sample = relationship("Sample", back_populates="cell_counts")
+    sample: Mapped[Optional["Sample"]] = relationship(back_populates="cell_counts", lazy="joined")
+
+# Cell populations stored as columns of the wide table, in column order
+CELL_POPULATIONS = ('b_cell', 'cd8_t_cell', 'cd4_t_cell', 'nk_cell', 'monocyte')
+
+class SampleCellCountsWide(Base):
+    """
+    The cell counts pivoted to one row per sample, plus their total. The rows of the samples
+    whose cell counts are written get refreshed in the same transaction (refresh_wide_counts).
+    Frequency queries read one row per sample from here instead of one per population, with no
+    window SUM or pivot needed to get the totals.
+    """
+    __tablename__ = 'sample_cell_counts_wide'
+
+    sample_id: Mapped[str] = mapped_column(String, ForeignKey('samples.sample_id'), primary_key=True)
+    b_cell: Mapped[Optional[int]] = mapped_column(Integer)
+    cd8_t_cell: Mapped[Optional[int]] = mapped_column(Integer)
+    cd4_t_cell: Mapped[Optional[int]] = mapped_column(Integer)
+    nk_cell: Mapped[Optional[int]] = mapped_column(Integer)
+    monocyte: Mapped[Optional[int]] = mapped_column(Integer)
+    total: Mapped[Optional[int]] = mapped_column(Integer)  # Sum over all populations of the sample
+
+# Recomputes wide rows from cell_counts: one row per sample with each population's count (0 if
+# it has none) and the total over all its rows. Run after every write to cell_counts (see
+# refresh_wide_counts), so the two tables never disagree.
+_WIDE_COUNTS_SELECT = f"""
+    SELECT sample_id,
+           {', '.join(f"SUM(CASE WHEN population = '{pop}' THEN count ELSE 0 END)" for pop in CELL_POPULATIONS)},
+           SUM(count)
+    FROM cell_counts
+"""
+_WIDE_COUNTS_INSERT = f"""
+    INSERT OR REPLACE INTO {SampleCellCountsWide.__tablename__}
+    (sample_id, {', '.join(CELL_POPULATIONS)}, total)
+"""
+CLEAR_WIDE_COUNTS_SQL = text(f"DELETE FROM {SampleCellCountsWide.__tablename__}")
+REFRESH_WIDE_COUNTS_SQL = text(_WIDE_COUNTS_INSERT + _WIDE_COUNTS_SELECT + """
+    WHERE sample_id IS NOT NULL
+    GROUP BY sample_id
+""")
+# The same for just the given samples (an expanding IN list)
+REFRESH_WIDE_COUNTS_FOR_SAMPLES_SQL = text(_WIDE_COUNTS_INSERT + _WIDE_COUNTS_SELECT + """
+    WHERE sample_id IN :sample_ids
+    GROUP BY sample_id
+""").bindparams(bindparam('sample_ids', expanding=True))
+# Samples per IN list, well below SQLite's bound-parameter limit
+WIDE_REFRESH_BATCH = 500
+
+def refresh_wide_counts(conn, sample_ids=None):
+    """
+    Brings sample_cell_counts_wide up to date with cell_counts, inside the caller's transaction:
+    only the rows of sample_ids (the samples whose cell counts were just written), or the whole
+    table if sample_ids is None.
+    """
+    if sample_ids is None:
+        conn.execute(CLEAR_WIDE_COUNTS_SQL)
+        conn.execute(REFRESH_WIDE_COUNTS_SQL)
+        return
+    sample_ids = list(dict.fromkeys(sid for sid in sample_ids if sid is not None))
+    for start in range(0, len(sample_ids), WIDE_REFRESH_BATCH):
+        conn.execute(REFRESH_WIDE_COUNTS_FOR_SAMPLES_SQL,
+                     {'sample_ids': sample_ids[start:start + WIDE_REFRESH_BATCH]})
+
+# Indexes for the analysis queries: the baseline/response filters on samples become a range
+# lookup instead of a full scan (its leading condition/treatment/sample_type columns also serve
+# filters on just those), and the joins find a parent's child rows by index. SQLite doesn't index
+# foreign key columns by itself, so each child side of a join gets one here.
+BASELINE_SAMPLES_INDEX = Index('ix_samples_baseline', Sample.condition, Sample.treatment,
+                               Sample.sample_type, Sample.time_from_treatment_start)
+CELL_COUNTS_SAMPLE_INDEX = Index('ix_cell_counts_sample', CellCount.sample_id)
+SAMPLES_SUBJECT_INDEX = Index('ix_samples_subject', Sample.subject_id)
+SUBJECTS_PROJECT_INDEX = Index('ix_subjects_project', Subject.project_id)
+ANALYSIS_INDEXES = (BASELINE_SAMPLES_INDEX, CELL_COUNTS_SAMPLE_INDEX,
+                    SAMPLES_SUBJECT_INDEX, SUBJECTS_PROJECT_INDEX)
+
+def _configure_sqlite_connection(dbapi_conn, connection_record, in_memory=False):
+    """Applies the journaling, cache and foreign key settings to each new SQLite connection."""
+    cursor = dbapi_conn.cursor()
+    if not in_memory: # An in-memory database has no file to write a WAL next to
+        cursor.execute("PRAGMA journal_mode=WAL") # Readers no longer block on the writer
+    # With WAL, NORMAL only syncs at checkpoints rather than on every commit
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY") # Sort/temp b-trees in memory
+    cursor.execute("PRAGMA mmap_size=268435456") # Memory-map up to 256 MiB of the file
+    cursor.execute("PRAGMA cache_size=-65536") # 64 MiB page cache (negative = KiB)
+    # SQLite only enforces the ForeignKey constraints when this is set on each connection
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
 
 # Create database engine
 def init_db(db_url='sqlite:///cytometry.db'):
     engine = create_engine(db_url)
+    if engine.dialect.name == 'sqlite':
+        in_memory = engine.url.database in (None, '', ':memory:')
+        event.listen(engine, 'connect', lambda dbapi_conn, record: _configure_sqlite_connection(
+            dbapi_conn, record, in_memory=in_memory))
+    # The wide table is filled from cell_counts when create_all adds it to an existing database
+    had_wide_table = inspect(engine).has_table(SampleCellCountsWide.__tablename__)
     Base.metadata.create_all(engine)
-    return engine 
\ No newline at end of file
+    # create_all skips tables that already exist, indexes included, so add the indexes
+    # separately for databases created before they were defined
+    for index in ANALYSIS_INDEXES:
+        index.create(engine, checkfirst=True)
+    if not had_wide_table:
+        with engine.begin() as conn:
+            refresh_wide_counts(conn)
+    return engine
+
+def bulk_insert_cell_counts(engine, rows):
+    """
+    Inserts cell count rows (dicts with sample_id, population and count) in one transaction,
+    as a single executemany-style insert instead of an ORM object and flush per row.
+    The id primary key stays autoincrementing, so rows don't need one; created_at gets its
+    column default. DataLoader.load_csv does the same insert inside its own load transaction.
+    The wide rows of the inserted samples are refreshed in the same transaction.
+    """
+    if not rows:
+        return
+    with engine.begin() as conn:
+        conn.execute(insert(CellCount), rows)
+        refresh_wide_counts(conn, [row['sample_id'] for row in rows])
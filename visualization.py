@@ -36,27 +36,120 @@ def plot_relative_frequencies_boxplot(data_df, output_filename="response_compari
     '''
 
 # visualization.py
-import matplotlib.pyplot as plt
+import json
+import os
+# Plots here are only saved to files, so figures are built directly on an Agg canvas rather than
+# through pyplot: no GUI toolkit is loaded, and the process-wide backend is left alone for
+# pyplot users such as CytometryAnalysis.plot_response_comparison (plt.show)
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 import seaborn as sns
+import numpy as np
 import pandas as pd # Ensure pandas is imported if not already
 
-def plot_relative_frequencies_boxplot(data_df, output_filename="response_comparison_boxplots.png"):
+# Response categories in plotting order (non-responders first)
+RESPONSE_ORDER = ['n', 'y']
+RESPONSE_DTYPE = pd.CategoricalDtype(RESPONSE_ORDER, ordered=True)
+
+# Plot style, set once at import rather than rewriting the rcParams on every plot call
+sns.set_style("whitegrid")
+
+# Box styling for the Axes.boxplot calls, matching what sns.boxplot drew: the palette colors at
+# seaborn's default 0.75 saturation, with dark gray outlines, whiskers, caps and medians
+RESPONSE_BOX_COLORS = [sns.desaturate('#EF4444', 0.75), sns.desaturate('#3B82F6', 0.75)] # n, y
+BOX_LINE_COLOR = (0.36, 0.36, 0.36)
+BOX_LINE_PROPS = {'color': BOX_LINE_COLOR, 'linewidth': 1}
+BOX_FLIER_PROPS = {'marker': 'o', 'markerfacecolor': 'none', 'markeredgecolor': BOX_LINE_COLOR}
+
+def _box_stats(values):
+    """
+    Box statistics of one group in the form Axes.bxp takes, with the same conventions as
+    Axes.boxplot: quartiles by linear interpolation, whiskers at the most extreme values within
+    1.5 IQR of the box, and everything beyond them as fliers.
+    """
+    if len(values) == 0:
+        return {'med': np.nan, 'q1': np.nan, 'q3': np.nan, 'whislo': np.nan, 'whishi': np.nan,
+                'fliers': values}
+    q1, med, q3 = np.percentile(values, [25, 50, 75])
+    iqr = q3 - q1
+    within_hi = values[values <= q3 + 1.5 * iqr]
+    whishi = q3 if len(within_hi) == 0 or within_hi.max() < q3 else within_hi.max()
+    within_lo = values[values >= q1 - 1.5 * iqr]
+    whislo = q1 if len(within_lo) == 0 or within_lo.min() > q1 else within_lo.min()
+    return {'med': med, 'q1': q1, 'q3': q3, 'whislo': whislo, 'whishi': whishi,
+            'fliers': values[(values < whislo) | (values > whishi)]}
+
+def _summary_stats(values, stats):
+    """
+    The JSON-ready summary of one group for the stats sidecar: its range, quartiles and size,
+    with None in place of NaN for a group that has no values.
+    """
+    def number(value):
+        return None if np.isnan(value) else float(value)
+    return {'min': number(values.min()) if len(values) else None,
+            'q1': number(stats['q1']), 'median': number(stats['med']), 'q3': number(stats['q3']),
+            'max': number(values.max()) if len(values) else None,
+            'n': int(len(values))}
+
+def stats_sidecar_filename(output_filename):
+    """The path of the box statistics JSON written next to a plot, e.g. 'plot.png' -> 'plot.stats.json'."""
+    return os.path.splitext(output_filename)[0] + '.stats.json'
+
+def _draw_response_boxes(ax, pop, stats):
+    """Draws the non-responder and responder boxes for one population from their box statistics."""
+    # Axes.bxp draws straight from the precomputed statistics, rather than seaborn's long-form
+    # pipeline (category inference, hue and palette handling) or Axes.boxplot's own stats pass
+    bplot = ax.bxp(stats, positions=[0, 1], widths=0.6, patch_artist=True,
+                   boxprops={'edgecolor': BOX_LINE_COLOR, 'linewidth': 1},
+                   whiskerprops=BOX_LINE_PROPS, capprops=BOX_LINE_PROPS,
+                   medianprops=BOX_LINE_PROPS, flierprops=BOX_FLIER_PROPS)
+    for box, color in zip(bplot['boxes'], RESPONSE_BOX_COLORS):
+        box.set_facecolor(color)
+    ax.set_xlim(-0.5, 1.5)
+    ax.xaxis.grid(False) # No grid lines along the categorical axis
+    ax.set_title(f'{pop} Relative Frequency')
+    ax.set_xlabel('Treatment Response')
+    ax.set_ylabel('Relative Frequency (%)')
+    ax.set_xticks(ticks=[0, 1])
+    ax.set_xticklabels(['Non-Responder (n)', 'Responder (y)'])
+
+def _draw_insufficient_data(ax, pop):
+    """Fills a population's subplot with a placeholder when one of the responses has no rows."""
+    ax.text(0.5, 0.5, 'Insufficient Data', horizontalalignment='center', verticalalignment='center', transform=ax.transAxes)
+    ax.set_title(f'{pop} Relative Frequency')
+    ax.set_xlabel('Treatment Response')
+    ax.set_ylabel('Relative Frequency (%)')
+    ax.set_xticks([]) # Hide ticks if no plot
+    ax.set_yticks([])
+
+def plot_relative_frequencies_boxplot(data_df, output_filename="response_comparison_boxplots.png",
+                                      dpi=120, vector=False):
     """
     Generates boxplots of relative frequencies comparing responders vs. non-responders
-    using Matplotlib/Seaborn and saves them to a file.
+    using Matplotlib (with Seaborn's style) and saves them to a file.
     
     Args:
         data_df (pd.DataFrame): Filtered DataFrame from analyze_melanoma_tr1_response.
                                  Expected to be in long format with 'population', 'percentage', 'response' columns.
         output_filename (str): Name for the output image file.
+        dpi (int): Resolution of a raster (e.g. PNG) output; 120 is plenty for on-screen viewing.
+        vector (bool): Save as SVG instead, with the boxes as vector shapes and no rasterization.
+                       The extension of output_filename is then changed to '.svg'. Also used
+                       whenever output_filename ends in '.svg'.
+
+    The box statistics are also written to a JSON sidecar next to the image (see
+    stats_sidecar_filename), shaped {population: {response: {min, q1, median, q3, max, n}}},
+    so consumers that need the numbers can read them instead of re-running the query and plot.
     """
     if data_df.empty:
         print("No data to plot for relative frequencies boxplot.")
         return
 
     # Ensure 'response' column is treated as categorical for consistent plotting order
-    # Also, ensure 'y' and 'n' are the only values, or handle others appropriately
-    data_df['response'] = pd.Categorical(data_df['response'], categories=['n', 'y'], ordered=True)
+    # Also, ensure 'y' and 'n' are the only values, or handle others appropriately.
+    # Both columns are cast once here (on a copy, leaving the caller's frame alone), so every
+    # per-population slice keeps the categorical dtypes and seaborn doesn't re-infer them
+    data_df = data_df.astype({'response': RESPONSE_DTYPE, 'population': 'category'})
 
     cell_populations = ['b_cell', 'cd8_t_cell', 'cd4_t_cell', 'nk_cell', 'monocyte']
 
@@ -65,35 +158,53 @@ def plot_relative_frequencies_boxplot(data_df, output_filename="response_compari
     fig_width = max(10, num_plots * 3) # Min 10, 3 inches per plot
     fig_height = 8 # Height per plot
 
-    plt.figure(figsize=(fig_width, fig_height))
-    sns.set_style("whitegrid")
+    # All the axes are created in one call (one gridspec) rather than one plt.subplot per plot.
+    # The figure isn't registered with pyplot, so there is nothing to close: it is freed with
+    # the last reference.
+    fig = Figure(figsize=(fig_width, fig_height))
+    FigureCanvasAgg(fig)
+    axes = fig.subplots(1, num_plots, sharey=False)
 
-    for i, pop in enumerate(cell_populations):
-        # Filter for the current population
-        pop_data = data_df[data_df['population'] == pop].copy()
-        
+    # All the box statistics are computed up front from three flat arrays: each row gets a group
+    # code (population x response), one stable argsort brings every group together, and
+    # searchsorted finds the group boundaries, so each box is a contiguous slice with no pandas
+    # group filtering. Rows whose population or response isn't plotted get code -1.
+    num_responses = len(RESPONSE_ORDER)
+    pop_codes = pd.Categorical(data_df['population'], categories=cell_populations).codes.astype(np.intp)
+    resp_codes = data_df['response'].cat.codes.to_numpy().astype(np.intp)
+    group_codes = np.where((pop_codes >= 0) & (resp_codes >= 0), pop_codes * num_responses + resp_codes, -1)
+    order = np.argsort(group_codes, kind='stable')
+    sorted_codes = group_codes[order]
+    sorted_values = data_df['percentage'].to_numpy(dtype=float)[order]
+    bounds = np.searchsorted(sorted_codes, np.arange(num_plots * num_responses + 1))
+
+    sidecar_stats = {}
+    for pop_code, (ax, pop) in enumerate(zip(axes, cell_populations)):
+        groups = range(pop_code * num_responses, (pop_code + 1) * num_responses)
+        # Missing percentages are dropped, as seaborn did
+        group_values = [sorted_values[bounds[g]:bounds[g + 1]] for g in groups]
+        group_values = [v[~np.isnan(v)] for v in group_values]
+        stats = [_box_stats(v) for v in group_values]
+        sidecar_stats[pop] = {resp: _summary_stats(v, st)
+                              for resp, v, st in zip(RESPONSE_ORDER, group_values, stats)}
         # Ensure there is data for both 'y' and 'n' responses for this population
-        if not pop_data.empty and pop_data['response'].nunique() > 1:
-            ax = plt.subplot(1, num_plots, i + 1)
-            # Use 'hue' only if 'response' is a reliable categorical variable
-            sns.boxplot(data=pop_data, x='response', y='percentage', hue='response', palette={'y': '#3B82F6', 'n': '#EF4444'}, ax=ax, legend=False)
-            ax.set_title(f'{pop} Relative Frequency')
-            ax.set_xlabel('Treatment Response')
-            ax.set_ylabel('Relative Frequency (%)')
-            ax.set_xticks(ticks=[0, 1])
-            ax.set_xticklabels(['Non-Responder (n)', 'Responder (y)'])
+        if all(bounds[g + 1] > bounds[g] for g in groups):
+            _draw_response_boxes(ax, pop, stats)
         else:
-            ax = plt.subplot(1, num_plots, i + 1)
-            ax.text(0.5, 0.5, 'Insufficient Data', horizontalalignment='center', verticalalignment='center', transform=ax.transAxes)
-            ax.set_title(f'{pop} Relative Frequency')
-            ax.set_xlabel('Treatment Response')
-            ax.set_ylabel('Relative Frequency (%)')
-            ax.set_xticks([]) # Hide ticks if no plot
-            ax.set_yticks([])
+            _draw_insufficient_data(ax, pop)
 
-    plt.tight_layout()
-    plt.suptitle("Relative Frequencies by Treatment Response (Melanoma, tr1, PBMC)", y=1.02, fontsize=16)
-    plt.savefig(output_filename, dpi=300, bbox_inches='tight')
+    fig.tight_layout()
+    fig.suptitle("Relative Frequencies by Treatment Response (Melanoma, tr1, PBMC)", y=1.02, fontsize=16)
+    if vector or output_filename.lower().endswith('.svg'):
+        # The file name must match the SVG bytes written, e.g. not the default '.png' name
+        stem, ext = os.path.splitext(output_filename)
+        if ext.lower() != '.svg':
+            output_filename = stem + '.svg'
+        fig.savefig(output_filename, format='svg', bbox_inches='tight')
+    else:
+        fig.savefig(output_filename, dpi=dpi, bbox_inches='tight')
     print(f"Boxplots saved to {output_filename}")
-    # plt.show() # Removed plt.show() for CLI batch processing, uncomment if you want immediate display
-    plt.close() # Close figure to free up memory
\ No newline at end of file
+    stats_filename = stats_sidecar_filename(output_filename)
+    with open(stats_filename, 'w') as f:
+        json.dump(sidecar_stats, f, indent=2)
+    print(f"Boxplot statistics saved to {stats_filename}")
\ No newline at end of file